@@ -1,31 +1,59 @@
 import os
+import hashlib
+import posixpath
 import random
-import mimetypes
 import sqlite3
 import time
 import json
 import re
-from pathlib import Path
-from typing import List, Optional
+import stat
+import struct
+import threading
+import queue
+from typing import BinaryIO, List, Optional
+from collections import OrderedDict
 from contextlib import contextmanager, asynccontextmanager
+from email.utils import formatdate
 from functools import lru_cache
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Response, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse
+from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
+from anyio import from_thread
 from pydantic import BaseModel
 from PIL import Image
-from natsort import natsort_key
+from natsort import natsort_keygen
 from cachetools import LRUCache
 
+try:
+    import orjson  # 可选依赖：安装后大列表的 JSON 编码更快
+except ImportError:
+    orjson = None
+
 # --- 配置 ---
-ROOT_DIR = os.environ.get("GALLERY_ROOT_DIR", os.path.dirname(os.path.abspath(__file__)))
+ROOT_DIR = os.path.abspath(os.environ.get("GALLERY_ROOT_DIR", os.path.dirname(os.path.abspath(__file__))))
 CERT_DIR = os.environ.get("GALLERY_CERT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "certificates"))
 SSL_CERT_FILE = os.environ.get("GALLERY_SSL_CERT")
 SSL_KEY_FILE = os.environ.get("GALLERY_SSL_KEY")
 DB_PATH = os.path.join(ROOT_DIR, "gallery_metadata.db")
-ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
+ALLOWED_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'})
+# str.endswith 接受元组且在 C 层完成比较，比 splitext + 集合查找更快
+IMAGE_SUFFIXES = tuple(sorted(ALLOWED_EXTENSIONS))
+# 只需小写文件名末尾这几个字符即可判断扩展名，避免为长文件名整体生成小写副本
+_IMAGE_SUFFIX_MAX_LEN = max(len(ext) for ext in ALLOWED_EXTENSIONS)
+# 扩展名 → Content-Type。只提供这几种图片，直接查表，不依赖系统 mimetypes 数据库（Windows 注册表里可能缺 .webp）
+IMAGE_MIME_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.bmp': 'image/bmp',
+}
 PLAYLIST_MAX_AGE_DAYS = 365  # Playlist 在数据库中保留的最大天数
 
 def env_to_bool(name: str, default: bool) -> bool:
@@ -44,12 +72,66 @@ def env_to_int(name: str, default: int, minimum: int, maximum: int) -> int:
         return default
     return max(minimum, min(maximum, parsed))
 
-DEFAULT_SCAN_WORKERS = min(16, max(1, (os.cpu_count() or 4) * 2))
+# 元数据探测只读文件头，属于 I/O 密集型，线程数可以高于 CPU 核数
+DEFAULT_SCAN_WORKERS = min(32, max(1, (os.cpu_count() or 4) * 4))
 SCAN_WORKERS = env_to_int("GALLERY_SCAN_WORKERS", DEFAULT_SCAN_WORKERS, 1, 32)
+# 大于 0 时，大批量文件头解析改用多进程（默认关闭）。JPEG 走纯 Python 的 SOF 解析，持有 GIL，
+# 变动文件很多且 CPU 成为瓶颈时多进程更快；文件较少时进程间传参的开销得不偿失，仍用线程池
+SCAN_PROCESSES = env_to_int("GALLERY_SCAN_PROCESSES", 0, 0, 64)
+PROCESS_PROBE_MIN_FILES = 2000
+# 启动扫描默认为增量扫描：目录 mtime 未变的目录直接沿用数据库记录，原地改写（目录 mtime 不变）的图片
+# 不会被重新解析。设为 1 时启动改为完整扫描，逐个比对文件 mtime；运行中可调用 POST /api/scan?full=true
+SCAN_FULL_ON_STARTUP = env_to_bool("GALLERY_FULL_SCAN_ON_STARTUP", False)
+
+# 只有 Windows 等非 '/' 分隔符平台才需要把路径分隔符转换为 '/'
+_NEED_SEP_FIX = os.sep != '/'
+# 带结尾分隔符的根目录前缀，用于以切片代替 os.path.relpath
+_ROOT_DIR_PREFIX = os.path.join(ROOT_DIR, '')
+# 越界判断用的比较形式（Windows 下路径不区分大小写，normcase 统一为小写；POSIX 下原样）
+_ROOT_DIR_CMP = os.path.normcase(ROOT_DIR)
+_ROOT_DIR_PREFIX_CMP = os.path.normcase(_ROOT_DIR_PREFIX)
+
+def to_posix_path(path: str) -> str:
+    return path.replace('\\', '/') if _NEED_SEP_FIX else path
+
+def rel_path_from_root(path: str) -> str:
+    """将路径转换为相对 ROOT_DIR 的 '/' 分隔路径；位于 ROOT_DIR 下时直接切片，否则回退 relpath。"""
+    if path.startswith(_ROOT_DIR_PREFIX):
+        return to_posix_path(path[len(_ROOT_DIR_PREFIX):])
+    rel = os.path.relpath(path, ROOT_DIR)
+    return "" if rel == "." else to_posix_path(rel)
+
+def abs_path_from_rel(rel: str) -> str:
+    """
+    rel_path_from_root 的逆操作：已经过 normalize_rel_path 的相对路径 → 绝对路径，
+    结果与 os.path.abspath(os.path.join(ROOT_DIR, rel)) 相同。
+    ROOT_DIR 已是绝对路径，ROOT_DIR 内的路径直接拼接前缀；只有 '../' 开头或需要转换分隔符时才 normpath。
+    """
+    if not rel:
+        return ROOT_DIR
+    if _NEED_SEP_FIX or rel.startswith('..'):
+        return os.path.normpath(_ROOT_DIR_PREFIX + rel)
+    return _ROOT_DIR_PREFIX + rel
+
+def is_image_filename(name: str) -> bool:
+    return name[-_IMAGE_SUFFIX_MAX_LEN:].lower().endswith(IMAGE_SUFFIXES)
+
+# 父目录访问开关的缓存值：进程内只有运行时配置接口会修改该环境变量，
+# 修改时通过 set_parent_dir_access 同步刷新，读取时无需每次解析环境变量
+_parent_dir_access: Optional[bool] = None
 
 def allow_parent_dir_access() -> bool:
-    """热读取父目录访问开关。"""
-    return env_to_bool("GALLERY_ALLOW_PARENT_DIR_ACCESS", True)
+    """读取父目录访问开关（首次调用时从环境变量加载）。"""
+    global _parent_dir_access
+    if _parent_dir_access is None:
+        _parent_dir_access = env_to_bool("GALLERY_ALLOW_PARENT_DIR_ACCESS", True)
+    return _parent_dir_access
+
+def set_parent_dir_access(enabled: bool):
+    """运行时修改父目录访问开关，同时写回环境变量供子进程/诊断接口读取。"""
+    global _parent_dir_access
+    os.environ["GALLERY_ALLOW_PARENT_DIR_ACCESS"] = "1" if enabled else "0"
+    _parent_dir_access = enabled
 
 # --- Pydantic 模型 ---
 class PlaylistRequest(BaseModel):
@@ -58,6 +140,7 @@ class PlaylistRequest(BaseModel):
     orientation: str = "Both"
     direction: str = "forward"
     current_path: Optional[str] = None
+    limit: Optional[int] = None  # 只返回 playlist 的前 N 张
 
 class RestorePlaylistRequest(BaseModel):
     """用于前端主动恢复 playlist 的请求模型"""
@@ -69,84 +152,421 @@ class RuntimeConfigRequest(BaseModel):
     allow_parent_dir_access: bool
 
 # --- 全局缓存与会话 ---
+# 预加载窗口：以当前图片为中心前后各预加载这么多张
+PRELOAD_WINDOW = 100
+# 当前位置与上次预加载中心的距离（按回绕计算）达到该值时才重新预加载，窗口之间保留一定重叠
+PRELOAD_RECENTER_DISTANCE = 90
+
 class UserSession:
     """用户会话，存储播放列表用于后续的图片请求判断"""
+    __slots__ = ("playlist", "criteria", "_index_map",
+                 "_preload_lock", "_preload_running", "_preload_target", "_preload_center")
+
     def __init__(self, playlist: List[str], criteria: Optional[dict] = None):
         self.playlist = playlist
         self.criteria = criteria
-        self.request_count = 0
+        self._index_map: Optional[dict] = None
+        self._preload_lock = threading.Lock()
+        self._preload_running = False
+        self._preload_target = 0                      # 最近一次请求的位置
+        self._preload_center: Optional[int] = None    # 最近一次完成预加载的中心
+
+    def _far_from_center(self, index: int) -> bool:
+        if self._preload_center is None:
+            return True
+        distance = abs(index - self._preload_center)
+        return min(distance, len(self.playlist) - distance) >= PRELOAD_RECENTER_DISTANCE
+
+    def request_preload(self, index: int) -> bool:
+        """
+        记录当前位置；需要启动新的预加载任务时返回 True（调用方负责调度 run_session_preload）。
+        同一会话同时最多只有一个预加载任务：任务运行期间到来的请求只更新目标位置，
+        由运行中的任务在结束前检查是否需要按新位置再跑一轮。
+        """
+        with self._preload_lock:
+            self._preload_target = index
+            if self._preload_running or not self._far_from_center(index):
+                return False
+            self._preload_running = True
+            return True
 
+    def cancel_preload(self):
+        with self._preload_lock:
+            self._preload_running = False
+
+    def next_preload_center(self, finished_center: Optional[int] = None) -> Optional[int]:
+        """预加载任务循环使用：记录刚完成的中心，返回下一轮的中心；无需继续时返回 None 并释放运行标记。"""
+        with self._preload_lock:
+            if finished_center is not None:
+                self._preload_center = finished_center
+            if self._far_from_center(self._preload_target):
+                return self._preload_target
+            self._preload_running = False
+            return None
+
+    def index_of(self, path: str) -> Optional[int]:
+        """
+        返回 path 在播放列表中的位置（重复出现时取第一个），不在列表中返回 None。
+        路径 → 下标的映射在首次查找时才建立，之后每次查找都是 O(1)，代替逐项比较的 list.index。
+        """
+        if self._index_map is None:
+            playlist = self.playlist
+            # 倒序写入，重复路径最终保留最小下标，与 list.index 一致
+            self._index_map = dict(zip(reversed(playlist), range(len(playlist) - 1, -1, -1)))
+        return self._index_map.get(path)
+
+# 客户端会话只在事件循环上读写（async 接口与 async 后台任务）；线程中的代码需经 clear_user_sessions 等回到事件循环
 user_sessions = LRUCache(maxsize=600)
 external_synced_paths_this_boot = set()
 
-@lru_cache(maxsize=2000)
-def get_image_content(path: str) -> bytes:
-    """从磁盘读取图片文件内容并缓存。"""
-    print(f"📦 [Image Cache MISS] 正在从磁盘加载: {os.path.basename(path)}")
-    with open(path, "rb") as f:
-        return f.read()
+# 图片内容缓存按字节数计算容量（而非条目数），避免少量大图把内存撑到数 GB
+IMAGE_CACHE_MAX_BYTES = env_to_int("GALLERY_IMAGE_CACHE_MB", 512, 0, 65536) * 1024 * 1024
+IMAGE_CACHE_SHARDS = 16
+# 单张图片最多占分片容量的 1/4（默认 512MB / 16 分片 → 单张上限 8MB）
+IMAGE_CACHE_ITEM_FRACTION = 4
+
+# 分片内受保护段（被请求过两次以上的图片）最多占用的比例，其余容量留给试用段
+IMAGE_CACHE_PROTECTED_RATIO = 0.75
+
+class SegmentedBytesCache:
+    """
+    单个分片的分段 LRU（SLRU，2Q 的一种变体），按字节数计容量，本身不加锁。
+    - 试用段：新写入（预加载）的图片先进入这里，按 FIFO 淘汰
+    - 受保护段：试用段中的图片第二次被请求时晋升到这里，按 LRU 淘汰
+    预加载写入 + 紧接着的一次查看只算一次引用；只看过一遍的图片（随机/连续播放的一次性扫描）
+    只会在试用段里相互淘汰，不会挤掉反复查看的图片。
+    受保护段未用满时试用段可以占用整个分片；受保护段超出上限时，最久未用的图片降级回试用段。
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.protected_max = int(max_bytes * IMAGE_CACHE_PROTECTED_RATIO)
+        self._probation = OrderedDict()   # key -> [bytes, 是否已被请求过]
+        self._protected = OrderedDict()   # key -> bytes
+        self._probation_bytes = 0
+        self._protected_bytes = 0
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._protected or key in self._probation
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self._protected.get(key)
+        if value is not None:
+            self._protected.move_to_end(key)
+            return value
+        entry = self._probation.get(key)
+        if entry is None:
+            return None
+        value = entry[0]
+        if not entry[1]:
+            entry[1] = True
+            return value
+        # 第二次请求：晋升到受保护段
+        del self._probation[key]
+        self._probation_bytes -= len(value)
+        self._protected[key] = value
+        self._protected_bytes += len(value)
+        while self._protected_bytes > self.protected_max:
+            old_key, old_value = self._protected.popitem(last=False)
+            self._protected_bytes -= len(old_value)
+            self._probation[old_key] = [old_value, False]
+            self._probation_bytes += len(old_value)
+        self._evict()
+        return value
+
+    def put(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        old_value = self._protected.pop(key, None)
+        if old_value is not None:
+            self._protected_bytes -= len(old_value)
+        old_entry = self._probation.pop(key, None)
+        if old_entry is not None:
+            self._probation_bytes -= len(old_entry[0])
+        self._probation[key] = [value, False]
+        self._probation_bytes += len(value)
+        self._evict()
+
+    def _evict(self):
+        while self._probation_bytes + self._protected_bytes > self.max_bytes:
+            if self._probation:
+                _, (old_value, _) = self._probation.popitem(last=False)
+                self._probation_bytes -= len(old_value)
+            else:
+                _, old_value = self._protected.popitem(last=False)
+                self._protected_bytes -= len(old_value)
+
+    def clear(self):
+        self._probation.clear()
+        self._protected.clear()
+        self._probation_bytes = 0
+        self._protected_bytes = 0
+
+class ShardedBytesCache:
+    """
+    按 key 哈希分片的字节数缓存：每个分片是独立的 SegmentedBytesCache + 锁，
+    并发请求与后台预加载落在不同分片时互不争用同一把锁。
+    单个值超过分片容量的 1/IMAGE_CACHE_ITEM_FRACTION 时不缓存：一张冷门大图不会把整个分片里的热点小图挤出去。
+    """
+    def __init__(self, max_bytes: int, shard_count: int):
+        self._mask = shard_count - 1  # shard_count 须为 2 的幂
+        self.max_item_bytes = max_bytes // shard_count // IMAGE_CACHE_ITEM_FRACTION
+        self._shards = [
+            (threading.Lock(), SegmentedBytesCache(max_bytes // shard_count))
+            for _ in range(shard_count)
+        ]
+
+    def _shard(self, key: str):
+        return self._shards[hash(key) & self._mask]
+
+    def __contains__(self, key: str) -> bool:
+        lock, cache = self._shard(key)
+        with lock:
+            return key in cache
+
+    def get(self, key: str) -> Optional[bytes]:
+        lock, cache = self._shard(key)
+        with lock:
+            return cache.get(key)
+
+    def put(self, key: str, value: bytes):
+        if len(value) > self.max_item_bytes:
+            return  # 大文件交给页缓存 + sendfile，不占用进程内缓存
+        lock, cache = self._shard(key)
+        with lock:
+            cache.put(key, value)
+
+    def clear(self):
+        for lock, cache in self._shards:
+            with lock:
+                cache.clear()
+
+image_cache = ShardedBytesCache(IMAGE_CACHE_MAX_BYTES, IMAGE_CACHE_SHARDS)
 
 # --- 数据库操作 ---
-@contextmanager
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-    finally:
-        conn.close()
+# 连接级 PRAGMA：WAL 下 NORMAL 同步只在 checkpoint 时 fsync，批量写入不再逐次落盘
+DB_CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+)
+
+DB_READER_POOL_SIZE = 4   # 启动时预先建立的读连接数
+DB_READER_POOL_MAX = 16   # 并发读取较多时按需扩容的上限，超出后排队等待空闲连接
+# 每条连接缓存的预编译语句数。playlist 查询模板（方向 × 根目录 × 排序 × LIMIT）
+# 加上其余固定 SQL 需留有余量，避免热点语句被挤出缓存后重新编译
+DB_CACHED_STATEMENTS = 256
+
+class SqlitePool:
+    """
+    进程级 SQLite 连接池：若干条读连接 + 一条由锁保护的写连接。
+    WAL 模式下读写互不阻塞，而 SQLite 同一时刻只允许一个写者，因此写操作统一走写连接串行执行。
+    连接在首次使用（init_db）时创建一次，PRAGMA 也只在创建时设置；
+    读连接用完归还而不关闭，页缓存在请求之间保持热态。
+    """
+    def __init__(self, db_path: str, reader_count: int, max_readers: int):
+        self.db_path = db_path
+        self.reader_count = reader_count
+        self.max_readers = max(reader_count, max_readers)
+        self._reader_total = 0
+        # close() 只清空队列、不丢弃它；每次关闭递增代数，关闭前借出的连接归还时直接关闭
+        self._readers = queue.Queue()
+        self._generation = 0
+        self._writer: Optional[sqlite3.Connection] = None
+        self._write_lock = threading.Lock()
+        self._open_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=DB_CACHED_STATEMENTS)
+        conn.row_factory = sqlite3.Row
+        for pragma in DB_CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def open(self):
+        with self._open_lock:
+            if self._writer is not None:
+                return
+            self._writer = self._connect()
+            for _ in range(self.reader_count):
+                self._readers.put(self._connect())
+            self._reader_total = self.reader_count
+
+    def _acquire_reader(self) -> sqlite3.Connection:
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._open_lock:
+            grow = self._reader_total < self.max_readers
+            if grow:
+                self._reader_total += 1
+        if grow:
+            return self._connect()
+        return self._readers.get()
+
+    @contextmanager
+    def reader(self):
+        if self._writer is None:
+            self.open()
+        generation = self._generation
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            # 归还前结束残留事务，避免后续借用者读到旧快照
+            if conn.in_transaction:
+                conn.rollback()
+            with self._open_lock:
+                keep = generation == self._generation
+                if keep:
+                    self._readers.put(conn)
+            if not keep:
+                conn.close()
+
+    @contextmanager
+    def writer(self):
+        if self._writer is None:
+            self.open()
+        with self._write_lock:
+            conn = self._writer
+            try:
+                yield conn
+                if conn.in_transaction:
+                    conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def close(self):
+        """
+        关闭全部连接（应用退出时调用）。最后一条连接关闭时 SQLite 会自动 checkpoint 并删除 -wal 文件。
+        此时仍被借出的读连接在归还时关闭。之后再次使用会按需重新建立连接。
+        """
+        with self._open_lock:
+            self._generation += 1
+            self._reader_total = 0
+            while True:
+                try:
+                    self._readers.get_nowait().close()
+                except queue.Empty:
+                    break
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+db_pool = SqlitePool(DB_PATH, DB_READER_POOL_SIZE, DB_READER_POOL_MAX)
+
+def get_read_db():
+    """借用一条读连接（仅用于查询与连接私有的临时表）。"""
+    return db_pool.reader()
+
+def get_write_db():
+    """独占写连接；正常退出时提交未结束的事务，异常时回滚。"""
+    return db_pool.writer()
+
+# images 表的二级索引。大批量写入前会临时删除、写完后重建。
+IMAGE_INDEXES = {
+    # playlist 查询的覆盖索引：WHERE/ORDER BY 涉及的列都在索引中，无需回表
+    # - 按方向筛选：先定位 is_landscape，再在其中做 path 范围扫描
+    "idx_images_cover": "CREATE INDEX IF NOT EXISTS idx_images_cover ON images(is_landscape, path, mtime)",
+    # - 不筛选方向：直接在 path 上做范围扫描
+    "idx_images_cover_both": "CREATE INDEX IF NOT EXISTS idx_images_cover_both ON images(path, mtime)",
+    # 按日期排序的 playlist 直接沿索引输出：(mtime DESC, path) 与 ORDER BY 完全一致且覆盖 path，
+    # 既不回表也不需要临时 B 树
+    "idx_images_mtime_path": "CREATE INDEX IF NOT EXISTS idx_images_mtime_path ON images(mtime DESC, path)",
+}
+# 一次扫描写入（upsert + 删除）的行数超过该值时，先删索引再批量写入，最后一次性重建
+BULK_REINDEX_THRESHOLD = 10_000
+
+# 建表/建索引脚本：通过 executescript 一次提交，整个 schema 初始化只有一个事务
+DB_SCHEMA_SCRIPT = '''
+    -- WAL 模式会持久化到数据库文件，只需设置一次（不能在事务内切换）
+    PRAGMA journal_mode=WAL;
+    BEGIN;
+    -- 图片元数据表
+    CREATE TABLE IF NOT EXISTS images (
+        path TEXT PRIMARY KEY, mtime REAL, width INTEGER,
+        height INTEGER, is_landscape BOOLEAN
+    );
+    -- 目录 mtime 表，用于增量扫描时跳过未变化的目录
+    CREATE TABLE IF NOT EXISTS dirs (
+        path TEXT PRIMARY KEY, mtime REAL
+    );
+    -- 【新增】播放列表持久化表
+    CREATE TABLE IF NOT EXISTS playlists (
+        client_ip TEXT PRIMARY KEY,
+        playlist TEXT NOT NULL,
+        criteria_json TEXT,
+        created_at REAL NOT NULL
+    );
+''' + "".join(f"    {ddl};\n" for ddl in IMAGE_INDEXES.values()) + '''
+    COMMIT;
+'''
 
 def init_db():
     """初始化数据库，创建必要的表"""
-    with get_db() as conn:
-        # 图片元数据表
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS images (
-                path TEXT PRIMARY KEY, mtime REAL, width INTEGER,
-                height INTEGER, is_landscape BOOLEAN
-            )''')
-        # 【新增】播放列表持久化表
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS playlists (
-                client_ip TEXT PRIMARY KEY,
-                playlist TEXT NOT NULL,
-                criteria_json TEXT,
-                created_at REAL NOT NULL
-            )''')
+    with get_write_db() as conn:
+        conn.executescript(DB_SCHEMA_SCRIPT)
+        # 旧版本数据库的 playlists 表缺少 criteria_json 列
         try:
             conn.execute("ALTER TABLE playlists ADD COLUMN criteria_json TEXT")
         except sqlite3.OperationalError:
             pass
         conn.commit()
-        print("📊 数据库表初始化完成 (images, playlists)")
+        print("📊 数据库表初始化完成 (images, dirs, playlists)")
+
+# playlist 列的存储格式：以换行符开头，其后为换行分隔的路径，读写只需一次 join/split。
+# JSON 数组总以 '[' 开头，因此旧版本写入的 JSON 记录仍可识别并读取；
+# 极少数文件名本身含换行符时退回 JSON 存储
+PLAYLIST_LINES_MARKER = "\n"
+
+def encode_playlist(playlist: List[str]) -> str:
+    joined = "\n".join(playlist)
+    if playlist and (not joined or joined.count("\n") != len(playlist) - 1):
+        return json.dumps(playlist)
+    return PLAYLIST_LINES_MARKER + joined
+
+def decode_playlist(raw: Optional[str]) -> Optional[List[str]]:
+    """解析 playlist 列；无法识别的内容返回 None。"""
+    if raw is None:
+        return None
+    if raw.startswith(PLAYLIST_LINES_MARKER):
+        body = raw[len(PLAYLIST_LINES_MARKER):]
+        return body.split("\n") if body else []
+    try:
+        playlist = json.loads(raw)
+    except json.JSONDecodeError:
+        return None
+    return playlist if isinstance(playlist, list) else None
 
 def save_playlist_to_db(client_ip: str, playlist: List[str], criteria: Optional[dict] = None):
-    """将播放列表保存到数据库"""
-    with get_db() as conn:
+    """将播放列表保存到数据库（整张列表一行，一次写入）"""
+    # 编码在取写锁之前完成，写锁只覆盖 SQL 执行本身，不拖慢并发的扫描/其它会话写入
+    row = (client_ip, encode_playlist(playlist), json.dumps(criteria) if criteria is not None else None, time.time())
+    with get_write_db() as conn:
         conn.execute(
             "INSERT OR REPLACE INTO playlists (client_ip, playlist, criteria_json, created_at) VALUES (?, ?, ?, ?)",
-            (client_ip, json.dumps(playlist), json.dumps(criteria) if criteria is not None else None, time.time())
+            row
         )
         conn.commit()
 
 def load_playlist_from_db(client_ip: str) -> Optional[List[str]]:
     """从数据库加载播放列表"""
-    with get_db() as conn:
+    with get_read_db() as conn:
         cursor = conn.execute(
             "SELECT playlist FROM playlists WHERE client_ip = ?", 
             (client_ip,)
         )
         row = cursor.fetchone()
         if row:
-            try:
-                return json.loads(row['playlist'])
-            except json.JSONDecodeError:
-                return None
+            return decode_playlist(row['playlist'])
     return None
 
 def load_playlist_record_from_db(client_ip: str) -> tuple[Optional[List[str]], Optional[dict]]:
     """从数据库加载 playlist 及其筛选条件。"""
-    with get_db() as conn:
+    with get_read_db() as conn:
         cursor = conn.execute(
             "SELECT playlist, criteria_json FROM playlists WHERE client_ip = ?",
             (client_ip,)
@@ -155,12 +575,8 @@ def load_playlist_record_from_db(client_ip: str) -> tuple[Optional[List[str]], O
         if not row:
             return None, None
 
-        playlist = None
+        playlist = decode_playlist(row['playlist'])
         criteria = None
-        try:
-            playlist = json.loads(row['playlist'])
-        except json.JSONDecodeError:
-            playlist = None
 
         criteria_raw = row['criteria_json'] if 'criteria_json' in row.keys() else None
         if criteria_raw:
@@ -171,72 +587,333 @@ def load_playlist_record_from_db(client_ip: str) -> tuple[Optional[List[str]], O
 
         return playlist, criteria
 
-def iter_image_files_safe(directory: str):
+def stat_known_subdirs(current: str, rel_prefix: str, children: List[str]) -> Optional[list]:
     """
-    使用 pathlib 做鲁棒遍历：
-    - 遇到异常目录/条目时跳过，不中断全局扫描
-    - 忽略隐藏目录（名称以 . 开头）
+    按上次扫描记录的子目录列表逐个 stat，代替列出整个目录。
+    任一子目录已不存在或不可访问时返回 None，由调用方回退到 scandir。
     """
-    base_dir = Path(directory)
-    if not base_dir.is_dir():
-        return
+    subdirs = []
+    for child_rel in children:
+        child_path = os.path.join(current, child_rel[len(rel_prefix):])
+        try:
+            subdirs.append((child_path, child_rel, os.stat(child_path).st_mtime))
+        except OSError:
+            return None
+    return subdirs
+
+def list_image_dir(current: str, current_rel: str, current_mtime: Optional[float],
+                   skip_unchanged_dir=None, known_subdirs=None):
+    """
+    列出单个目录：返回 (子目录列表, 图片文件列表)。
+    子目录项为 (绝对路径, 相对路径, mtime)，仅在需要比对目录 mtime 时才 stat；图片项为 (绝对路径, 相对路径, mtime)。
+    known_subdirs(目录相对路径, 目录mtime) 对未变化的目录给出上次记录的子目录时，其直接子项必然没有增删：
+    只 stat 这些子目录，不再读取整个目录（文件很多的目录省去全部目录项的读取）。
+    作为遍历线程池的任务执行，各目录之间互不依赖。
+    """
+    rel_prefix = current_rel + '/' if current_rel else ""
+
+    if known_subdirs is not None and skip_unchanged_dir:
+        children = known_subdirs(current_rel, current_mtime)
+        if children is not None:
+            subdirs = stat_known_subdirs(current, rel_prefix, children)
+            if subdirs is not None:
+                skip_unchanged_dir(current_rel, current_mtime)  # 记录目录 mtime
+                return subdirs, []
+
+    subdirs = []
+    files = []
+    try:
+        with os.scandir(current) as it:
+            entries = list(it)
+    except Exception as e:
+        print(f"⚠️ 跳过无法访问目录: {current} ({e})")
+        return subdirs, files
+
+    skip_files = bool(skip_unchanged_dir and skip_unchanged_dir(current_rel, current_mtime))
+
+    for entry in entries:
+        entry_name = entry.name
 
-    stack = [base_dir]
-    while stack:
-        current = stack.pop()
         try:
-            entries = list(current.iterdir())
+            if entry.is_dir():
+                if not entry_name.startswith('.'):
+                    dir_mtime = entry.stat().st_mtime if skip_unchanged_dir else None
+                    subdirs.append((entry.path, rel_prefix + entry_name, dir_mtime))
+                continue
         except Exception as e:
-            print(f"⚠️ 跳过无法访问目录: {current} ({e})")
+            print(f"⚠️ 跳过无法判断目录项: {entry.path} ({e})")
             continue
 
-        for entry in entries:
-            try:
-                entry_name = entry.name
-            except Exception as e:
-                print(f"⚠️ 跳过异常目录项: {current} ({e})")
-                continue
+        # 先做纯字符串的扩展名判断，非图片条目（以及跳过的目录中的全部文件）不再触发 is_file/stat
+        if skip_files or not is_image_filename(entry_name):
+            continue
 
-            try:
-                if entry.is_dir():
-                    if not entry_name.startswith('.'):
-                        stack.append(entry)
-                    continue
-            except Exception as e:
-                print(f"⚠️ 跳过无法判断目录项: {entry} ({e})")
+        try:
+            if not entry.is_file():
                 continue
+        except Exception as e:
+            print(f"⚠️ 跳过无法判断文件项: {entry.path} ({e})")
+            continue
 
-            try:
-                if not entry.is_file():
-                    continue
-            except Exception as e:
-                print(f"⚠️ 跳过无法判断文件项: {entry} ({e})")
-                continue
+        try:
+            mtime = entry.stat().st_mtime
+        except Exception as e:
+            print(f"⚠️ 跳过无法读取文件状态: {entry.path} ({e})")
+            continue
 
-            if entry.suffix.lower() in ALLOWED_EXTENSIONS:
-                yield entry
+        files.append((entry.path, rel_prefix + entry_name, mtime))
 
-def process_image_metadata(file_path: Path, root_dir: str) -> Optional[dict]:
-    """线程池任务：读取单张图片元数据。"""
-    try:
-        stat = file_path.stat()
-        mtime = stat.st_mtime
+    return subdirs, files
 
-        with Image.open(file_path) as img:
-            width, height = img.size
-            is_landscape = width >= height
+def iter_image_files_safe(directory: str, skip_unchanged_dir=None, rel_base: str = "", known_subdirs=None):
+    """
+    使用 os.scandir 做鲁棒遍历（DirEntry 自带文件类型，避免每个文件额外 stat）：
+    - 遇到异常目录/条目时跳过，不中断全局扫描
+    - 忽略隐藏目录（名称以 . 开头）
+    - skip_unchanged_dir(目录相对路径, 目录mtime) 返回 True 时，不再 stat/产出该目录下的文件，
+      但仍会继续遍历其子目录（目录 mtime 只反映直接子项的增删）
+    - known_subdirs(目录相对路径, 目录mtime) 对未变化的目录返回上次记录的子目录相对路径列表（否则返回 None），
+      此时只 stat 这些子目录而不再列出该目录
+    rel_base 为 directory 自身的相对路径（'/' 分隔，根目录为 ''），子项的相对路径沿途拼接得到，
+    不再对每个文件调用 relpath。
+    每个目录作为独立任务提交到共享线程池并行列出，冷缓存时目录读取的 I/O 延迟可以相互重叠；
+    因此 skip_unchanged_dir 可能在工作线程中被调用，产出顺序也不固定。
+    返回: (绝对路径, 相对路径, mtime) 迭代器
+    """
+    if not os.path.isdir(directory):
+        return
 
-        rel_path = os.path.relpath(str(file_path), root_dir).replace('\\', '/')
-        return {
-            'path': rel_path,
-            'mtime': mtime,
-            'width': width,
-            'height': height,
-            'is_landscape': is_landscape
-        }
+    root_mtime = os.stat(directory).st_mtime if skip_unchanged_dir else None
+    root = (directory, rel_base, root_mtime)
+
+    if SCAN_WORKERS <= 1:
+        stack = [root]
+        while stack:
+            subdirs, files = list_image_dir(*stack.pop(), skip_unchanged_dir, known_subdirs)
+            stack.extend(subdirs)
+            yield from files
+        return
+
+    executor = get_probe_executor()
+    pending = {executor.submit(list_image_dir, *root, skip_unchanged_dir, known_subdirs)}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            subdirs, files = future.result()
+            for subdir in subdirs:
+                pending.add(executor.submit(list_image_dir, *subdir, skip_unchanged_dir, known_subdirs))
+            yield from files
+
+# JPEG 中携带宽高的 SOF 段标记（排除 DHT=C4、JPG=C8、DAC=CC）
+JPEG_SOF_MARKERS = frozenset({0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF})
+
+def read_jpeg_size(f: BinaryIO) -> Optional[tuple[int, int]]:
+    """
+    直接解析 JPEG 段结构读取 SOF 中的宽高，不经过 PIL。f 为已打开的二进制文件，从当前位置（文件开头）读取。
+    只按段长度 seek 跳过 EXIF 等数据，读取的字节数与像素量无关；
+    无法解析时返回 None，由调用方回退到 PIL。
+    """
+    if f.read(2) != b'\xff\xd8':
+        return None
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        while code == 0xFF:  # 段之间允许填充 0xFF
+            fill = f.read(1)
+            if not fill:
+                return None
+            code = fill[0]
+        if code == 0x01 or 0xD0 <= code <= 0xD8:  # 无长度的独立标记
+            continue
+        if code in (0xD9, 0xDA):  # 到达 EOI/SOS 仍未找到 SOF
+            return None
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        seg_len = struct.unpack('>H', length_bytes)[0]
+        if seg_len < 2:
+            return None
+        if code in JPEG_SOF_MARKERS:
+            sof = f.read(5)
+            if len(sof) < 5:
+                return None
+            _, height, width = struct.unpack('>BHH', sof)
+            if width == 0 or height == 0:
+                return None
+            return width, height
+        f.seek(seg_len - 2, os.SEEK_CUR)
+
+def read_png_size(head: bytes) -> Optional[tuple[int, int]]:
+    """PNG：签名后第一个块必须是 IHDR，宽高为其中两个大端 uint32。"""
+    if len(head) < 24 or head[:8] != b'\x89PNG\r\n\x1a\n' or head[12:16] != b'IHDR':
+        return None
+    width, height = struct.unpack('>II', head[16:24])
+    return (width, height) if width and height else None
+
+def read_webp_size(head: bytes) -> Optional[tuple[int, int]]:
+    """
+    WebP：RIFF 头之后的第一个块决定格式。
+    VP8X 取画布尺寸（与 PIL 一致），VP8L 为 14 位宽高 - 1，VP8 从关键帧头读取 14 位宽高。
+    """
+    if len(head) < 30 or head[:4] != b'RIFF' or head[8:12] != b'WEBP':
+        return None
+    chunk = head[12:16]
+    if chunk == b'VP8X':
+        width = int.from_bytes(head[24:27], 'little') + 1
+        height = int.from_bytes(head[27:30], 'little') + 1
+    elif chunk == b'VP8L':
+        if head[20] != 0x2F:
+            return None
+        bits = int.from_bytes(head[21:25], 'little')
+        width = (bits & 0x3FFF) + 1
+        height = ((bits >> 14) & 0x3FFF) + 1
+    elif chunk == b'VP8 ':
+        if head[23:26] != b'\x9d\x01\x2a':
+            return None
+        width, height = struct.unpack('<HH', head[26:30])
+        width &= 0x3FFF
+        height &= 0x3FFF
+    else:
+        return None
+    return (width, height) if width and height else None
+
+def read_gif_size(head: bytes) -> Optional[tuple[int, int]]:
+    """GIF：逻辑屏幕描述符紧跟在 6 字节签名之后，宽高为小端 uint16（与 PIL 的 size 一致）。"""
+    if len(head) < 10 or head[:6] not in (b'GIF87a', b'GIF89a'):
+        return None
+    width, height = struct.unpack_from('<HH', head, 6)
+    return (width, height) if width and height else None
+
+def read_bmp_size(head: bytes) -> Optional[tuple[int, int]]:
+    """
+    BMP：14 字节文件头之后是 DIB 头。OS/2 的 12 字节核心头为 uint16 宽高，其余版本为 int32；
+    高度为负表示自上而下存储，尺寸取绝对值。
+    """
+    if len(head) < 26 or head[:2] != b'BM':
+        return None
+    (dib_size,) = struct.unpack_from('<I', head, 14)
+    if dib_size == 12:
+        width, height = struct.unpack_from('<HH', head, 18)
+    elif dib_size >= 40:
+        width, height = struct.unpack_from('<ii', head, 18)
+        height = abs(height)
+    else:
+        return None
+    return (width, height) if width > 0 and height > 0 else None
+
+# 按扩展名提示 PIL 只尝试对应的解码插件，省去逐个插件的格式探测
+PIL_FORMAT_HINTS = {
+    '.png': ('PNG',),
+    '.gif': ('GIF',),
+    '.webp': ('WEBP',),
+    '.bmp': ('BMP',),
+    '.jpg': ('JPEG',),
+    '.jpeg': ('JPEG',),
+}
+
+# 文件头嗅探读取的字节数：足以覆盖 PNG 的 IHDR、WebP 的首个块头与 BMP 的 DIB 宽高
+IMAGE_HEADER_SNIFF_BYTES = 32
+
+def read_image_size(file_path: str) -> tuple[int, int]:
+    """
+    只读取文件头获取 (宽, 高)，不解码像素。
+    按魔数识别 JPEG/PNG/WebP/GIF/BMP 并直接解析文件头，不经过 PIL；
+    其余格式或解析失败时使用 PIL 的惰性 Image.open（仅解析文件头）。
+    注意：返回的是原始像素尺寸，不考虑 EXIF 旋转，is_landscape 亦按此计算。
+    """
+    # 整个探测过程只打开一次文件：快速解析失败、格式提示不符时都 seek 回开头复用同一个句柄
+    with open(file_path, 'rb') as f:
+        head = f.read(IMAGE_HEADER_SNIFF_BYTES)
+        size = None
+        if head[:2] == b'\xff\xd8':
+            f.seek(0)
+            size = read_jpeg_size(f)
+        elif head[:4] == b'\x89PNG':
+            size = read_png_size(head)
+        elif head[:4] == b'RIFF':
+            size = read_webp_size(head)
+        elif head[:3] == b'GIF':
+            size = read_gif_size(head)
+        elif head[:2] == b'BM':
+            size = read_bmp_size(head)
+        if size is not None:
+            return size
+        f.seek(0)
+
+        # 只访问 .size，绝不调用 load()/copy()/convert()/exif_transpose，否则会触发完整解码
+        ext = file_path[file_path.rfind('.'):].lower()
+        hint = PIL_FORMAT_HINTS.get(ext)
+        if hint:
+            try:
+                return Image.open(f, formats=hint).size
+            except Exception:
+                f.seek(0)  # 扩展名与实际格式不符时退回完整格式探测
+
+        return Image.open(f).size
+
+def probe_image_row(item: tuple[str, str, float]) -> Optional[tuple]:
+    """
+    线程池任务：探测单张图片尺寸。
+    输入 (绝对路径, 相对路径, mtime)，返回可直接写库的 (path, mtime, width, height, is_landscape)。
+    """
+    file_path, rel_path, mtime = item
+    try:
+        width, height = read_image_size(file_path)
     except Exception as e:
         print(f"⚠️ 无法读取图片 {file_path}: {e}")
         return None
+    return (rel_path, mtime, width, height, width >= height)
+
+_probe_executor: Optional[ThreadPoolExecutor] = None
+_probe_executor_lock = threading.Lock()
+
+def get_probe_executor() -> ThreadPoolExecutor:
+    """
+    进程内共享的文件头探测 / 目录遍历线程池（惰性创建）。
+    读文件头、列目录都是 I/O 密集型操作，期间会释放 GIL，线程数可以远多于 CPU 核数；
+    复用同一个池，避免每次扫描/浏览都重新创建线程。池中任务彼此不等待，不会相互阻塞。
+    """
+    global _probe_executor
+    if _probe_executor is None:
+        with _probe_executor_lock:
+            if _probe_executor is None:
+                _probe_executor = ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix="probe")
+    return _probe_executor
+
+_probe_process_pool: Optional[ProcessPoolExecutor] = None
+
+def get_probe_process_pool() -> ProcessPoolExecutor:
+    """多进程文件头解析池（仅在 GALLERY_SCAN_PROCESSES > 0 时惰性创建）。"""
+    global _probe_process_pool
+    if _probe_process_pool is None:
+        with _probe_executor_lock:
+            if _probe_process_pool is None:
+                _probe_process_pool = ProcessPoolExecutor(max_workers=SCAN_PROCESSES)
+    return _probe_process_pool
+
+def shutdown_probe_process_pool():
+    """应用退出时关闭多进程解析池：不等待、取消尚未开始的任务，避免子进程拖住退出。"""
+    global _probe_process_pool
+    with _probe_executor_lock:
+        pool, _probe_process_pool = _probe_process_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def probe_image_rows(items: List[tuple]) -> List[tuple]:
+    """
+    批量探测 (绝对路径, 相对路径, mtime) 列表，返回成功解析的 images 行。
+    默认在共享线程池中执行；开启多进程且文件数足够多时分块交给进程池（只传递字符串元组，序列化开销小）。
+    """
+    if SCAN_PROCESSES > 0 and len(items) >= PROCESS_PROBE_MIN_FILES:
+        chunksize = max(1, len(items) // (SCAN_PROCESSES * 8))
+        rows = get_probe_process_pool().map(probe_image_row, items, chunksize=chunksize)
+    elif min(SCAN_WORKERS, len(items)) <= 1:
+        rows = map(probe_image_row, items)
+    else:
+        rows = get_probe_executor().map(probe_image_row, items)
+    return [row for row in rows if row]
 
 def scan_directory_for_images_lazy(directory: str) -> List[tuple[str, str]]:
     """
@@ -250,9 +927,8 @@ def scan_directory_for_images_lazy(directory: str) -> List[tuple[str, str]]:
     
     results = []
     try:
-        for file_path in iter_image_files_safe(full_dir):
-            rel_path = os.path.relpath(str(file_path), ROOT_DIR).replace('\\', '/')
-            results.append((file_path.name, rel_path))
+        for file_path, rel_path, _ in iter_image_files_safe(full_dir, rel_base=rel_path_from_root(full_dir)):
+            results.append((os.path.basename(file_path), rel_path))
     except Exception as e:
         print(f"❌ 轻量级扫描 {full_dir} 失败: {e}")
     
@@ -268,99 +944,225 @@ def scan_directory_for_images_heavy(directory: str) -> List[dict]:
     if not os.path.isdir(full_dir):
         return []
 
+    # 目录自身的相对路径只算一次，其下文件的相对路径由遍历时逐级拼接
     try:
-        all_files = list(iter_image_files_safe(full_dir))
+        items = list(iter_image_files_safe(full_dir, rel_base=rel_path_from_root(full_dir)))
     except Exception as e:
         print(f"❌ 完整扫描 {full_dir} 失败: {e}")
         return []
 
-    if not all_files:
+    if not items:
         return []
 
-    results = []
-    max_workers = min(SCAN_WORKERS, len(all_files))
-    print(f"🧵 并发扫描目录: {full_dir} | 文件数 {len(all_files)} | 线程数 {max_workers}")
-
-    if max_workers <= 1:
-        for file_path in all_files:
-            metadata = process_image_metadata(file_path, ROOT_DIR)
-            if metadata:
-                results.append(metadata)
-        return results
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(process_image_metadata, file_path, ROOT_DIR) for file_path in all_files]
-        for future in as_completed(futures):
-            try:
-                metadata = future.result()
-                if metadata:
-                    results.append(metadata)
-            except Exception as e:
-                print(f"⚠️ 并发任务异常（已忽略）: {e}")
-    
-    return results
+    print(f"🧵 并发扫描目录: {full_dir} | 文件数 {len(items)}")
+
+    return [
+        {'path': path, 'mtime': mtime, 'width': width, 'height': height, 'is_landscape': is_landscape}
+        for path, mtime, width, height, is_landscape in probe_image_rows(items)
+    ]
+
+def image_row(img: dict) -> tuple:
+    """扫描结果字典 → images 表的一行 (path, mtime, width, height, is_landscape)。"""
+    return (img['path'], img['mtime'], img['width'], img['height'], img['is_landscape'])
+
+# images 表的写入代数：每次提交对 images 的写入后加一（在写锁内执行，写入本身已串行）。
+# 读侧据此判断由数据推导出的缓存结果是否仍然有效
+_images_generation = 0
+# (代数, ROOT_DIR 外是否没有任何记录)
+_no_external_rows_cache: Optional[tuple[int, bool]] = None
+
+def note_images_written():
+    """在提交 images 的写入之后、释放写锁之前调用。"""
+    global _images_generation
+    _images_generation += 1
+
+def no_external_image_rows(conn: sqlite3.Connection) -> bool:
+    """
+    库中是否没有 ROOT_DIR 外（'../' 开头）的记录。结果按写入代数缓存，
+    images 未被写入时不再重复探测；代数在探测前读取，探测期间发生的写入会让这次结果直接失效。
+    """
+    global _no_external_rows_cache
+    generation = _images_generation
+    cached = _no_external_rows_cache
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+    value = conn.execute(
+        "SELECT 1 FROM images WHERE path >= '../' AND path < '..0' LIMIT 1"
+    ).fetchone() is None
+    _no_external_rows_cache = (generation, value)
+    return value
 
 def save_images_to_db(images: List[dict]):
     """将扫描到的图片元数据保存到数据库"""
     if not images:
         return
     
-    with get_db() as conn:
-        conn.executemany(
-            "INSERT OR REPLACE INTO images (path, mtime, width, height, is_landscape) VALUES (?, ?, ?, ?, ?)",
-            [(img['path'], img['mtime'], img['width'], img['height'], img['is_landscape']) for img in images]
-        )
+    with get_write_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        upsert_image_rows(conn, [image_row(img) for img in images])
         conn.commit()
+        note_images_written()
     print(f"💾 已保存 {len(images)} 张图片到数据库")
 
 def is_path_in_root_dir(path: str) -> bool:
-    """检查路径是否在 ROOT_DIR 范围内"""
+    """检查路径是否在 ROOT_DIR 范围内（规范化为绝对路径后做前缀比较，无需 commonpath 逐段比对）"""
     try:
-        if not path or path == "." or path == "":
+        if not path or path == ".":
             return True
-        full_path = os.path.abspath(os.path.join(ROOT_DIR, path))
-        common = os.path.commonpath([ROOT_DIR, full_path])
-        return common == ROOT_DIR
-    except (ValueError, TypeError):
-        return False
-
-def is_db_path_under_root(db_path: str) -> bool:
-    """判断数据库中的相对路径是否位于 ROOT_DIR 内。"""
-    try:
-        full_path = os.path.abspath(os.path.join(ROOT_DIR, db_path))
-        return os.path.commonpath([ROOT_DIR, full_path]) == ROOT_DIR
+        full_path = os.path.normcase(os.path.abspath(os.path.join(ROOT_DIR, path)))
+        return full_path == _ROOT_DIR_CMP or full_path.startswith(_ROOT_DIR_PREFIX_CMP)
     except (ValueError, TypeError):
         return False
 
 def normalize_rel_path(path: str) -> str:
-    return (path or "").replace('\\', '/').strip('/').replace('/./', '/')
+    """统一为数据库中的相对路径形式：'/' 分隔、折叠 '.'/'..'/重复分隔符，根目录为 ''。"""
+    rel = (path or "").replace('\\', '/').strip('/')
+    if not rel:
+        return ""
+    rel = posixpath.normpath(rel)
+    return "" if rel == "." else rel
+
+def is_rel_path_in_root(rel: str) -> bool:
+    """对已经过 normalize_rel_path 的相对路径做纯字符串判断，等价于 is_path_in_root_dir 但无需拼接绝对路径。"""
+    return rel != ".." and not rel.startswith("../")
+
+# 自然排序键函数只生成一次（默认算法，与 natsort_key 排序结果一致），省去每次调用的参数绑定
+natural_key = natsort_keygen()
+# 播放列表路径的排序键按路径缓存：同一批图片反复按名称/分组排序时不再重新切分字符串。
+# 每 10 万条约占 50MB，GALLERY_SORT_KEY_CACHE=0 可关闭
+SORT_KEY_CACHE_SIZE = env_to_int("GALLERY_SORT_KEY_CACHE", 100_000, 0, 10_000_000)
+
+@lru_cache(maxsize=SORT_KEY_CACHE_SIZE)
+def path_sort_key(path: str):
+    return natural_key(path)
 
-def folder_name_prefix_from_first_item(items: List[dict]) -> str:
+_COPY_SUFFIX_RE = re.compile(r'\s*\(\d+\)$')
+
+def folder_name_prefix_from_first_item(items: List[str]) -> str:
     if not items:
         return ""
-    first_path = items[0]['path']
+    first_path = items[0]
     stem = os.path.splitext(os.path.basename(first_path))[0]
-    return re.sub(r'\s*\(\d+\)$', '', stem).strip()
+    return _COPY_SUFFIX_RE.sub('', stem).strip()
+
+def group_paths_by_folder(paths: List[str]) -> dict:
+    """
+    按所在目录分组，保持组内原有顺序（dict 保留目录首次出现的顺序）。
+    先对整个列表做一次自然排序再分组，各组即已有序，无需逐组再排。
+    """
+    groups = {}
+    for path in paths:
+        # 库内路径均为不带结尾 '/' 的相对路径，rpartition 与 posixpath.dirname 结果相同但快数倍
+        parent = path.rpartition('/')[0]
+        items = groups.get(parent)
+        if items is None:
+            groups[parent] = [path]
+        else:
+            items.append(path)
+    return groups
 
 def sanitize_playlist_paths(paths: List[str]) -> List[str]:
     """
     对 playlist 请求路径做标准化。
     当不允许访问父目录时，所有越界路径都回退为 '.'，从而返回 ROOT_DIR 结果。
     """
-    normalized = []
+    allow_parent = allow_parent_dir_access()
+    # 标准化与去重在同一遍完成：dict 键保持首次出现的顺序
+    normalized = {}
     for path in paths:
         if not path or path == ".":
-            normalized.append(".")
+            normalized["."] = None
             continue
         rel = normalize_rel_path(path)
-        if not allow_parent_dir_access() and not is_path_in_root_dir(rel):
-            normalized.append(".")
+        if not rel or (not allow_parent and not is_rel_path_in_root(rel)):
+            normalized["."] = None
         else:
-            normalized.append(rel)
-    return list(dict.fromkeys(normalized))
+            normalized[rel] = None
+    return list(normalized)
+
+def path_prefix_range(prefix: str) -> tuple[str, str]:
+    """
+    将目录前缀转换为半开区间 [prefix/, prefix0)，等价于 path LIKE 'prefix/%'，
+    但可以直接走 path 主键索引做范围扫描（'0' 是 '/' 的下一个字符）。
+    """
+    return prefix + '/', prefix + '0'
 
-def escape_like_pattern(value: str) -> str:
-    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+def collapse_nested_paths(paths: List[str]) -> List[str]:
+    """
+    对 playlist 路径做最小化：去重，并移除已被其它选中目录包含的子目录。
+    根目录（'.'）覆盖 ROOT_DIR 内的全部路径，只有外部路径需要单独保留。
+    """
+    has_root = any(p == "" or p == "." for p in paths)
+    kept = []
+    # 以 'p/' 排序后，某目录的所有子目录都紧跟在它之后
+    for p in sorted({p for p in paths if p != "" and p != "."}, key=lambda p: p + '/'):
+        if has_root and is_rel_path_in_root(p):
+            continue
+        if kept and p.startswith(kept[-1] + '/'):
+            continue
+        kept.append(p)
+    return (["."] if has_root else []) + kept
+
+# 目录区间以 JSON 数组 [[lo, hi], ...] 作为单个参数传入，经 json_each 展开成行；
+# 无论选中多少个目录，SQL 文本都相同
+PATH_RANGES_SUBQUERY = (
+    "(SELECT json_extract(value, '$[0]') AS lo, json_extract(value, '$[1]') AS hi "
+    "FROM json_each(:ranges)) r"
+)
+
+@lru_cache(maxsize=256)
+def playlist_path_ranges(paths: tuple) -> tuple[bool, str]:
+    """
+    将选中的目录集合（排序后的元组，作为缓存键）转换为 (是否包含根目录, :ranges 参数的 JSON)。
+    被父目录覆盖的子目录不再单独生成区间，各区间互不重叠，也不会产生重复行。
+    同一组目录反复切换排序/方向/筛选时直接复用，SQL 文本本身由 build_playlist_query 缓存。
+    """
+    collapsed = collapse_nested_paths(list(paths))
+    has_root = bool(collapsed) and collapsed[0] == "."
+    prefixes = collapsed[1:] if has_root else collapsed
+    return has_root, json.dumps([path_prefix_range(p) for p in prefixes], ensure_ascii=False)
+
+@lru_cache(maxsize=64)
+def build_playlist_query(filter_orientation: bool, has_root: bool, order_by: str,
+                         with_limit: bool = False, whole_table: bool = False) -> str:
+    """
+    生成 playlist 查询 SQL，使用命名参数：:orientation（可选）、:ranges（目录区间 JSON）、:limit（可选）。
+    - 未选根目录：区间表与 images 连接，每个区间在 path 索引上做一次范围查找
+    - 选中根目录：结果接近整张表，直接扫描并排除未选中的外部路径（'../' 开头）
+    - whole_table=True：选中范围就是整张表，不生成任何路径条件（也不使用 :ranges）
+    结果按模板参数缓存，相同模板的 SQL 文本完全一致。
+    """
+    conditions = []
+    if filter_orientation:
+        conditions.append("is_landscape = :orientation")
+
+    query = "SELECT path FROM images"
+    if not whole_table:
+        range_match = "path >= r.lo AND path < r.hi"
+        if has_root:
+            conditions.append(
+                f"(path < '../' OR path >= '..0' OR EXISTS (SELECT 1 FROM {PATH_RANGES_SUBQUERY} WHERE {range_match}))"
+            )
+        else:
+            # CROSS JOIN 固定以区间表为外层循环，images 侧走索引范围扫描
+            query = f"SELECT path FROM {PATH_RANGES_SUBQUERY} CROSS JOIN images"
+            conditions.append(range_match)
+
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    if order_by:
+        query += " ORDER BY " + order_by
+    if with_limit:
+        query += " LIMIT :limit"
+    return query
+
+# “哪些目录在 images 中没有任何记录”：目录列表以 JSON 数组传入，SQL 文本固定。
+# 每个目录在 path 索引上做一次 [dir/, dir0) 区间探测，按请求顺序（json_each 的 key）返回缺失的目录
+MISSING_PATHS_QUERY = (
+    "SELECT req.value FROM json_each(:paths) req WHERE NOT EXISTS "
+    "(SELECT 1 FROM images WHERE images.path >= req.value || '/' AND images.path < req.value || '0') "
+    "ORDER BY req.key"
+)
 
 def sync_external_path_to_db(path: str):
     """
@@ -372,37 +1174,35 @@ def sync_external_path_to_db(path: str):
     if not normalized:
         return
 
-    full_path = os.path.abspath(os.path.join(ROOT_DIR, normalized))
+    full_path = abs_path_from_rel(normalized)
     scanned = scan_directory_for_images_heavy(full_path)
     scanned_paths = {item['path'] for item in scanned}
 
-    like_prefix = f"{escape_like_pattern(normalized)}/%"
+    lo, hi = path_prefix_range(normalized)
 
-    with get_db() as conn:
+    with get_write_db() as conn:
+        # 显式 BEGIN IMMEDIATE：一开始就拿到写锁，upsert 与清理在同一事务内只提交一次
+        conn.execute("BEGIN IMMEDIATE")
         if scanned:
-            conn.executemany(
-                "INSERT OR REPLACE INTO images (path, mtime, width, height, is_landscape) VALUES (?, ?, ?, ?, ?)",
-                [(img['path'], img['mtime'], img['width'], img['height'], img['is_landscape']) for img in scanned]
-            )
+            upsert_image_rows(conn, [image_row(img) for img in scanned])
 
         cursor = conn.execute(
-            "SELECT path FROM images WHERE path LIKE ? ESCAPE '\\'",
-            (like_prefix,)
+            "SELECT path FROM images WHERE path >= ? AND path < ?",
+            (lo, hi)
         )
-        existing_paths = [row['path'] for row in cursor]
-        to_delete = [p for p in existing_paths if p not in scanned_paths]
-
+        to_delete = [row[0] for row in cursor if row[0] not in scanned_paths]
         if to_delete:
-            conn.executemany("DELETE FROM images WHERE path = ?", [(p,) for p in to_delete])
+            delete_image_rows(conn, to_delete)
 
         conn.commit()
+        note_images_written()
 
     print(f"🔄 外部路径同步完成: {normalized} | 扫描 {len(scanned)} | 清理失效 {len(to_delete)}")
 
 def clean_old_playlists():
     """清理过期的播放列表记录"""
     cutoff_time = time.time() - (PLAYLIST_MAX_AGE_DAYS * 24 * 3600)
-    with get_db() as conn:
+    with get_write_db() as conn:
         cursor = conn.execute(
             "DELETE FROM playlists WHERE created_at < ?", 
             (cutoff_time,)
@@ -412,123 +1212,316 @@ def clean_old_playlists():
         if deleted_count > 0:
             print(f"🧹 已清理 {deleted_count} 条过期的播放列表记录")
 
-def clear_all_playlists():
-    """清空所有播放列表记录（当文件发生变动时调用）"""
-    with get_db() as conn:
-        conn.execute("DELETE FROM playlists")
-        conn.commit()
-    print("🗑️ 已清空数据库中的所有播放列表记录")
-
 # --- 后台预加载任务 ---
+PRELOAD_WORKERS = 16
+_preload_executor = ThreadPoolExecutor(max_workers=PRELOAD_WORKERS, thread_name_prefix="preload")
+
+_HAS_FADVISE = hasattr(os, "posix_fadvise")
+
+def preload_image(path: str) -> bool:
+    """
+    预加载单张图片；文件不存在或读取失败时返回 False。
+    调用方已确认未命中缓存：能放进内存缓存的直接读取后写入；
+    超过单项上限的大图只提示内核预读（posix_fadvise WILLNEED），不向用户态复制任何字节，
+    由页缓存持有，之后 FileResponse 的 sendfile 直接命中。
+    GALLERY_IMAGE_CACHE_MB=0 时单项上限为 0，预加载完全走 fadvise，进程内存不随预加载增长。
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    except OSError:
+        return False  # 文件已被删除或不可读，忽略
+    try:
+        size = os.fstat(fd).st_size
+        if size > image_cache.max_item_bytes:
+            # 不支持 fadvise 的平台（Windows/macOS）上读入后也放不进缓存，直接跳过
+            if _HAS_FADVISE:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            return True
+        with open(fd, "rb", closefd=False) as f:
+            content = f.read()
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+    image_cache.put(path, content)
+    return True
+
 def preload_surrounding_images(playlist: List[str], current_index: int):
     """后台任务，用于预加载当前图片周围的图片，并支持列表回绕。"""
     playlist_len = len(playlist)
     if playlist_len == 0:
         return
 
-    preload_window = 100 # 300
-    print(f"🔥 后台回绕预加载任务启动: 当前索引 {current_index}, 窗口大小 ±{preload_window}")
-    
-    loaded_count = 0
-    for i in range(current_index - preload_window, current_index + preload_window + 1):
-        wrapped_index = i % playlist_len
-        try:
-            image_path_full = os.path.join(ROOT_DIR, playlist[wrapped_index])
-            if os.path.exists(image_path_full):
-                get_image_content(image_path_full)
-                loaded_count += 1
-        except Exception:
-            pass  # 忽略单张图片加载失败
-            
+    print(f"🔥 后台回绕预加载任务启动: 当前索引 {current_index}, 窗口大小 ±{PRELOAD_WINDOW}")
+
+    # 列表短于窗口时回绕会重复命中同一张图，先去重；已在缓存中的直接跳过
+    window_paths = dict.fromkeys(
+        abs_path_from_rel(playlist[i % playlist_len])
+        for i in range(current_index - PRELOAD_WINDOW, current_index + PRELOAD_WINDOW + 1)
+    )
+    missing = [path for path in window_paths if path not in image_cache]
+
+    # 未命中的图片交给预加载线程池并发读取，各文件的 open/read 相互重叠
+    loaded_count = len(window_paths) - len(missing)
+    loaded_count += sum(_preload_executor.map(preload_image, missing))
+
     print(f"✅ 后台回绕预加载任务完成, 已缓存 {loaded_count} 张图片")
 
+def run_session_preload(session: UserSession):
+    """
+    后台任务：会话的唯一预加载任务。按最新请求的位置预加载，
+    期间位置又移出了已预加载的范围时继续下一轮，否则结束并允许下次请求重新触发。
+    """
+    center = session.next_preload_center()
+    try:
+        while center is not None:
+            preload_surrounding_images(session.playlist, center)
+            center = session.next_preload_center(center)
+    except Exception as e:
+        print(f"⚠️ 预加载任务异常结束: {e}")
+        session.cancel_preload()
+
+def schedule_session_preload(session: UserSession, index: int, background_tasks: BackgroundTasks):
+    if session.request_preload(index):
+        background_tasks.add_task(run_session_preload, session)
+
+def clear_user_sessions():
+    """清空所有客户端会话。扫描在线程池中执行时切回事件循环清空，不与接口中的读写交错。"""
+    try:
+        from_thread.run_sync(user_sessions.clear)
+    except RuntimeError:
+        # 不在 AnyIO 工作线程中（启动时在事件循环上同步执行扫描），直接清空
+        user_sessions.clear()
+
 # --- 扫描任务 ---
-def scan_library_task():
-    print("🔍 开始扫描图库...")
+@lru_cache(maxsize=8)
+def multi_row_upsert_sql(row_count: int) -> str:
+    return (
+        "INSERT OR REPLACE INTO images (path, mtime, width, height, is_landscape) VALUES "
+        + ", ".join(["(?, ?, ?, ?, ?)"] * row_count)
+    )
+
+def max_sql_variables(conn: sqlite3.Connection) -> int:
+    """单条语句允许绑定的参数个数上限（旧版本 SQLite 为 999）。"""
+    if hasattr(conn, "getlimit"):
+        return conn.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+    return 999
+
+def upsert_image_rows(conn: sqlite3.Connection, rows: List[tuple]):
+    """
+    用多行 VALUES 分块写入 images，每块只解析/执行一条语句。
+    每块行数受 SQLite 单条语句参数上限约束。
+    探测结果来自线程池，顺序是乱的：先按 path 排序，写入沿主键 B 树顺序推进，
+    相邻行落在同一批页上（5 万行随机顺序写入约快 2 倍）。
+    """
+    rows = sorted(rows)
+    rows_per_statement = max(1, min(5000, max_sql_variables(conn) // 5))
+    for start in range(0, len(rows), rows_per_statement):
+        chunk = rows[start:start + rows_per_statement]
+        conn.execute(multi_row_upsert_sql(len(chunk)), [value for row in chunk for value in row])
+
+def delete_image_rows(conn: sqlite3.Connection, paths: List[str]):
+    """
+    一条语句批量删除：路径排序后以 JSON 数组传入，经 json_each 展开，
+    不受参数个数上限约束，也无需分块或临时表；有序的删除沿主键顺序推进。
+    """
+    conn.execute(
+        "DELETE FROM images WHERE path IN (SELECT value FROM json_each(?))",
+        (json.dumps(sorted(paths), ensure_ascii=False),)
+    )
+
+def write_scan_changes(to_upsert: List[tuple], to_delete: List[str],
+                       changed_dirs: List[tuple], removed_dirs: List[str], clear_playlists: bool = False):
+    """
+    在一个事务中写入扫描差异：upsert 变动图片、删除失效图片、更新目录 mtime 表中变化的目录；
+    clear_playlists=True 时同时清空持久化的播放列表，与图片删除一起提交，不会出现只完成一半的状态。
+    大批量写入（如首次全量扫描、整库移动）时先删除二级索引，避免每行都维护多棵 B 树。
+    """
+    bulk = len(to_upsert) + len(to_delete) > BULK_REINDEX_THRESHOLD
+    with get_write_db() as conn:
+        # 所有写入放进同一个显式事务，整次扫描只提交一次
+        conn.execute("BEGIN IMMEDIATE")
+        if bulk:
+            for name in IMAGE_INDEXES:
+                conn.execute(f"DROP INDEX IF EXISTS {name}")
+        if to_delete:
+            delete_image_rows(conn, to_delete)
+        if to_upsert:
+            upsert_image_rows(conn, to_upsert)
+        if bulk:
+            for ddl in IMAGE_INDEXES.values():
+                conn.execute(ddl)
+
+        # 只写入新增/变化的目录、删除已消失的目录，供下次增量扫描比对
+        if removed_dirs:
+            conn.executemany("DELETE FROM dirs WHERE path = ?", [(d,) for d in removed_dirs])
+        if changed_dirs:
+            conn.executemany("INSERT OR REPLACE INTO dirs (path, mtime) VALUES (?, ?)", changed_dirs)
+        if clear_playlists:
+            conn.execute("DELETE FROM playlists")
+        conn.commit()
+        note_images_written()
+
+        # 大批量写入后 WAL 文件会膨胀到与写入量相当：立即合并回主库并截断，
+        # 同时让 SQLite 基于新数据刷新查询规划统计
+        if bulk:
+            conn.execute("PRAGMA optimize")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    if clear_playlists:
+        print("🗑️ 已清空数据库中的所有播放列表记录")
+
+def ensure_db_statistics():
+    """
+    images 表还没有统计信息（新库、空库或从未分析过）时执行一次 ANALYZE，
+    让查询规划器了解各索引的选择性，稳定选用覆盖索引；之后由大批量写入后的 PRAGMA optimize 维护。
+    """
+    with get_write_db() as conn:
+        try:
+            has_stats = conn.execute(
+                "SELECT 1 FROM sqlite_stat1 WHERE tbl = 'images' LIMIT 1"
+            ).fetchone() is not None
+        except sqlite3.OperationalError:  # sqlite_stat1 尚未创建
+            has_stats = False
+        if not has_stats:
+            conn.execute("ANALYZE")
+            conn.commit()
+
+def scan_library_task(full: bool = False):
+    """
+    增量扫描 ROOT_DIR：目录 mtime 与上次扫描一致时，直接沿用数据库中该目录下的文件记录，
+    只对发生增删的目录逐个 stat 文件。
+    目录 mtime 不会因文件被原地改写而变化，full=True 时强制对所有文件重新比对。
+    文件系统快照写入临时表 fs_scan，与 images 的差异比对由 SQLite 完成。
+    """
+    print(f"🔍 开始{'完整' if full else '增量'}扫描图库...")
     start_time = time.time()
     changes = 0
-    
-    fs_files = {}
-    for file_path in iter_image_files_safe(ROOT_DIR):
-        try:
-            rel_path = os.path.relpath(str(file_path), ROOT_DIR).replace('\\', '/')
-            mtime = file_path.stat().st_mtime
-            fs_files[rel_path] = (file_path, mtime)
-        except Exception as e:
-            print(f"⚠️ 跳过无法读取文件状态: {file_path} ({e})")
 
-    with get_db() as conn:
-        cursor = conn.execute("SELECT path, mtime FROM images")
-        db_files = {row['path']: row['mtime'] for row in cursor}
+    with get_read_db() as conn:
+        # 扫描涉及的结果集可达数十万行：用普通元组游标，省去每行构造 sqlite3.Row
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        stored_dirs = dict(cursor.execute("SELECT path, mtime FROM dirs"))
 
-        files_to_update = [
-            file_path
-            for path, (file_path, mtime) in fs_files.items()
-            if path not in db_files or db_files[path] != mtime
-        ]
+        # 上次扫描记录的目录树：父目录 → 直接子目录列表（根目录 '' 自身不作为子项）
+        stored_children = {}
+        for d in stored_dirs:
+            if d:
+                stored_children.setdefault(posixpath.dirname(d), []).append(d)
 
-        to_upsert = []
-        if files_to_update:
-            max_workers = min(SCAN_WORKERS, len(files_to_update))
-            print(f"🚀 检测到 {len(files_to_update)} 个变动文件，开始并发解析（线程数 {max_workers}）...")
-
-            if max_workers <= 1:
-                for file_path in files_to_update:
-                    metadata = process_image_metadata(file_path, ROOT_DIR)
-                    if metadata:
-                        to_upsert.append((
-                            metadata['path'],
-                            metadata['mtime'],
-                            metadata['width'],
-                            metadata['height'],
-                            metadata['is_landscape']
-                        ))
-            else:
-                with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    futures = [executor.submit(process_image_metadata, file_path, ROOT_DIR) for file_path in files_to_update]
-                    for future in as_completed(futures):
-                        try:
-                            metadata = future.result()
-                            if metadata:
-                                to_upsert.append((
-                                    metadata['path'],
-                                    metadata['mtime'],
-                                    metadata['width'],
-                                    metadata['height'],
-                                    metadata['is_landscape']
-                                ))
-                        except Exception as e:
-                            print(f"⚠️ 并发任务异常（已忽略）: {e}")
-
-        # 仅清理 ROOT_DIR 内失效文件。ROOT_DIR 外的条目保持不动，等待用户再次访问该目录时按需刷新。
-        to_delete = [
-            path for path in db_files
-            if is_db_path_under_root(path) and path not in fs_files
-        ]
+        def known_subdirs(rel_dir: str, dir_mtime: float) -> Optional[List[str]]:
+            if full or stored_dirs.get(rel_dir) != dir_mtime:
+                return None
+            return stored_children.get(rel_dir, [])
 
-        if to_upsert:
-            conn.executemany(
-                "INSERT OR REPLACE INTO images (path, mtime, width, height, is_landscape) VALUES (?, ?, ?, ?, ?)", 
-                to_upsert
-            )
-            changes += len(to_upsert)
-            print(f"✨ 新增/更新了 {len(to_upsert)} 张图片")
-        
-        if to_delete:
-            conn.executemany("DELETE FROM images WHERE path = ?", [(p,) for p in to_delete])
-            changes += len(to_delete)
-            print(f"🗑️ 移除了 {len(to_delete)} 张失效图片")
+        current_dirs = {}
+        unchanged_dirs = set()
 
-        conn.commit()
+        def skip_unchanged_dir(rel_dir: str, dir_mtime: float) -> bool:
+            current_dirs[rel_dir] = dir_mtime
+            if not full and stored_dirs.get(rel_dir) == dir_mtime:
+                unchanged_dirs.add(rel_dir)
+                return True
+            return False
+
+        # WITHOUT ROWID：临时表只有主键一棵 B 树，插入与 JOIN 查找都不必再经过 rowid 表
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS fs_scan (path TEXT PRIMARY KEY, mtime REAL) WITHOUT ROWID")
+        conn.execute("DELETE FROM fs_scan")
+
+        # mtime 直接取自遍历时的 DirEntry，不再对每个文件单独 stat；遍历结果直接流入临时表
+        conn.executemany(
+            "INSERT OR REPLACE INTO fs_scan (path, mtime) VALUES (?, ?)",
+            ((rel_path, mtime) for _, rel_path, mtime in
+             iter_image_files_safe(ROOT_DIR, skip_unchanged_dir, known_subdirs=known_subdirs))
+        )
+
+        # 目录集合与各目录 mtime 都与上次一致：没有任何文件增删，跳过差异比对与写库，热启动扫描近乎零开销
+        if not full and stored_dirs and len(unchanged_dirs) == len(current_dirs) == len(stored_dirs):
+            files_to_update, to_delete = [], []
+            total_files = conn.execute(
+                "SELECT COUNT(*) FROM images WHERE path < '../' OR path >= '..0'"
+            ).fetchone()[0]
+            print(f"⏭️ {len(current_dirs)} 个目录均未变化，跳过差异比对")
+        else:
+            # 未变化目录下的文件沿用数据库记录（mtime 相同，因此不会触发重新解析），也不复制进 fs_scan：
+            # fs_scan 只保存发生变化的目录中的文件，临时表大小与变动量成正比而不是与图库规模成正比。
+            # rtrim(path, 去掉 '/' 的 path) 会剥掉文件名，得到 'dir/'（根目录下为 ''）。
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS scan_unchanged_dirs (prefix TEXT PRIMARY KEY) WITHOUT ROWID")
+            conn.execute("DELETE FROM scan_unchanged_dirs")
+            if unchanged_dirs:
+                conn.executemany(
+                    "INSERT INTO scan_unchanged_dirs (prefix) VALUES (?)",
+                    [(d + '/' if d else "",) for d in unchanged_dirs]
+                )
+                print(f"⏭️ {len(unchanged_dirs)}/{len(current_dirs)} 个目录未变化，跳过文件级检查")
+
+            cursor.execute('''
+                SELECT fs.path, fs.mtime, i.path IS NULL FROM fs_scan fs
+                LEFT JOIN images i ON i.path = fs.path
+                WHERE i.path IS NULL OR i.mtime IS NOT fs.mtime
+            ''')
+            files_to_update = []
+            new_paths = set()
+            for path, mtime, is_new in cursor:
+                files_to_update.append((abs_path_from_rel(path), path, mtime))
+                if is_new:
+                    new_paths.add(path)
+
+            # 仅清理 ROOT_DIR 内、且位于已变化目录中的失效文件。ROOT_DIR 外的条目（'../' 开头）保持不动，
+            # 等待用户再次访问该目录时按需刷新。
+            cursor.execute('''
+                SELECT path FROM images i
+                WHERE (path < '../' OR path >= '..0')
+                  AND NOT EXISTS (SELECT 1 FROM fs_scan fs WHERE fs.path = i.path)
+                  AND rtrim(path, replace(path, '/', '')) NOT IN (SELECT prefix FROM scan_unchanged_dirs)
+            ''')
+            to_delete = list(map(itemgetter(0), cursor))
+
+            total_files = conn.execute(
+                "SELECT COUNT(*) FROM images WHERE path < '../' OR path >= '..0'"
+            ).fetchone()[0] - len(to_delete)
+            conn.execute("DELETE FROM fs_scan")
+            conn.execute("DELETE FROM scan_unchanged_dirs")
+            conn.commit()
+
+    to_upsert = []
+    if files_to_update:
+        print(f"🚀 检测到 {len(files_to_update)} 个变动文件，开始并发解析...")
+        to_upsert = probe_image_rows(files_to_update)
+        # 只计入解析成功、实际写库的新文件
+        total_files += sum(1 for row in to_upsert if row[0] in new_paths)
+
+    # 解析失败的文件（仍在复制中、文件被截断、被其它进程锁定）不写库，其所在目录也不记录真实 mtime，
+    # 而是记为 -1：目录仍留在父目录的已知子目录中，下次增量扫描 mtime 必然不一致，会重新列出并重试这些文件
+    failed_dirs = set()
+    if len(to_upsert) < len(files_to_update):
+        probed = set(map(itemgetter(0), to_upsert))
+        failed_dirs = {posixpath.dirname(rel_path) for _, rel_path, _ in files_to_update if rel_path not in probed}
+    changed_dirs = [
+        (d, -1.0) if d in failed_dirs else (d, m)
+        for d, m in current_dirs.items() if stored_dirs.get(d) != m or d in failed_dirs
+    ]
+    removed_dirs = [d for d in stored_dirs if d not in current_dirs]
+    if files_to_update or to_delete or changed_dirs or removed_dirs:
+        # 有文件被删除时，持久化的播放列表与扫描差异在同一事务中清空
+        write_scan_changes(to_upsert, to_delete, changed_dirs, removed_dirs, clear_playlists=bool(to_delete))
+    if to_upsert:
+        changes += len(to_upsert)
+        print(f"✨ 新增/更新了 {len(to_upsert)} 张图片")
+    if to_delete:
+        changes += len(to_delete)
+        print(f"🗑️ 移除了 {len(to_delete)} 张失效图片")
 
     if len(to_delete) > 0:
         print("🔄 文件发生删除，清空所有缓存...")
-        user_sessions.clear()
-        get_image_content.cache_clear()
-        clear_all_playlists()  # 【新增】同时清空持久化的播放列表
+        clear_user_sessions()
+        image_cache.clear()
+        path_sort_key.cache_clear()
     
+    ensure_db_statistics()
+
     duration = time.time() - start_time
-    print(f"✅ 扫描完成，耗时 {duration:.2f}秒。当前总图片数: {len(fs_files)}")
+    print(f"✅ 扫描完成，耗时 {duration:.2f}秒。当前总图片数: {total_files}")
 
 
 # --- FastAPI 应用生命周期 ---
@@ -538,8 +1531,10 @@ async def lifespan(app: FastAPI):
     external_synced_paths_this_boot.clear()
     init_db()
     # clean_old_playlists()  # 清理过期的播放列表
-    scan_library_task()
+    scan_library_task(full=SCAN_FULL_ON_STARTUP)
     yield
+    db_pool.close()
+    shutdown_probe_process_pool()
     print("👋 应用已关闭。")
 
 app = FastAPI(lifespan=lifespan)
@@ -552,9 +1547,29 @@ app.add_middleware(
 )
 
 # --- API 接口 ---
+def json_response(content) -> Response:
+    """
+    直接序列化为 JSON 响应。返回普通 list/dict 时 FastAPI 会先用 jsonable_encoder 逐元素转换一遍，
+    数万条路径的 playlist 上这一步比编码本身还慢；这里跳过它，装有 orjson 时用 orjson 编码。
+    orjson 不支持的值（如客户端 criteria 中超过 64 位的整数）退回标准库 json 编码。
+    """
+    body = None
+    if orjson is not None:
+        try:
+            body = orjson.dumps(content)
+        except TypeError:  # orjson.JSONEncodeError 是 TypeError 的子类
+            pass
+    if body is None:
+        body = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return Response(content=body, media_type="application/json")
+
 @app.post("/api/scan")
-async def trigger_scan(background_tasks: BackgroundTasks):
-    background_tasks.add_task(scan_library_task)
+async def trigger_scan(background_tasks: BackgroundTasks, full: bool = False):
+    """
+    后台扫描图库。默认增量扫描：只检查 mtime 发生变化的目录，目录内文件被原地改写（替换内容、
+    目录 mtime 不变）时不会重新解析尺寸。需要重新比对所有文件时传 full=true。
+    """
+    background_tasks.add_task(scan_library_task, full)
     return {"status": "scanning_started"}
 
 @app.get("/api/runtime-config")
@@ -566,7 +1581,7 @@ async def get_runtime_config():
 
 @app.post("/api/runtime-config")
 async def set_runtime_config(req: RuntimeConfigRequest):
-    os.environ["GALLERY_ALLOW_PARENT_DIR_ACCESS"] = "1" if req.allow_parent_dir_access else "0"
+    set_parent_dir_access(req.allow_parent_dir_access)
     return {
         "status": "ok",
         "allow_parent_dir_access": allow_parent_dir_access(),
@@ -575,8 +1590,7 @@ async def set_runtime_config(req: RuntimeConfigRequest):
 
 @app.post("/api/runtime-config/toggle")
 async def toggle_runtime_config():
-    new_value = not allow_parent_dir_access()
-    os.environ["GALLERY_ALLOW_PARENT_DIR_ACCESS"] = "1" if new_value else "0"
+    set_parent_dir_access(not allow_parent_dir_access())
     return {
         "status": "ok",
         "allow_parent_dir_access": allow_parent_dir_access(),
@@ -592,66 +1606,83 @@ async def get_playlist(req: PlaylistRequest, request: Request, background_tasks:
     req_paths = sanitize_playlist_paths(req.paths)
 
     # --- 步骤 1: 外部路径先做按需同步（确保第二次访问时能清理失效记录） ---
-    external_paths = [normalize_rel_path(p) for p in req_paths if p not in ("", ".") and not is_path_in_root_dir(p)]
-    external_paths = list(dict.fromkeys(external_paths))
+    external_paths = [p for p in req_paths if p != "." and not is_rel_path_in_root(p)]
     for ext_path in external_paths:
         if ext_path not in external_synced_paths_this_boot:
             sync_external_path_to_db(ext_path)
             external_synced_paths_this_boot.add(ext_path)
 
     # --- 步骤 2: 先查数据库，缺失路径才扫描并回填 ---
-    def query_images_from_db(paths: List[str]) -> List[dict]:
-        query = "SELECT path, mtime, is_landscape FROM images WHERE ("
-        params = []
-        path_conditions = []
-
-        for p in paths:
-            if p == "" or p == ".":
-                path_conditions.append("path NOT LIKE '../%'")
-            else:
-                path_conditions.append("path LIKE ? || '/%'")
-                params.append(p)
-
-        query += " OR ".join(path_conditions) + ")"
-        if req.orientation == 'Landscape':
-            query += " AND is_landscape = 1"
-        elif req.orientation == 'Portrait':
-            query += " AND is_landscape = 0"
-
-        with get_db() as conn:
-            cursor = conn.execute(query, params)
-            return [dict(row) for row in cursor]
+    def query_images_from_db(paths: List[str], order_by: str = "", limit: Optional[int] = None) -> List[str]:
+        """只取 path 列；能在 SQL 内完成的排序通过 order_by 交给 SQLite。"""
+        params = {}
+
+        # 方向过滤与路径区间同时作用于 (is_landscape, path, mtime) 覆盖索引
+        filter_orientation = req.orientation in ('Landscape', 'Portrait')
+        if filter_orientation:
+            params['orientation'] = 1 if req.orientation == 'Landscape' else 0
+
+        has_root, ranges = playlist_path_ranges(tuple(sorted(paths)))
+
+        with get_read_db() as conn:
+            # 选中根目录且库中没有 ROOT_DIR 外的记录时，路径条件恒为真（外部区间也必然为空），直接整表查询。
+            # 最常见的“只选根目录”请求由此退化为 SELECT path FROM images [ORDER BY ...]，探测结果按写入代数缓存
+            whole_table = has_root and no_external_image_rows(conn)
+
+            if not whole_table:
+                params['ranges'] = ranges
+            if limit is not None:
+                params['limit'] = limit
+            query = build_playlist_query(filter_orientation, has_root, order_by, limit is not None, whole_table)
+
+            # 只取单列，用普通元组代替 sqlite3.Row，省去每行的 Row 对象；
+            # 直接迭代游标取第一列，不再先 fetchall 出一份中间元组列表
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute(query, params)
+            return list(map(itemgetter(0), cursor))
 
     def get_missing_paths_from_db(paths: List[str]) -> List[str]:
-        """在 SQL 层判断哪些路径在 images 表中没有任何命中。"""
-        missing = []
-        with get_db() as conn:
-            for p in paths:
-                if p == "" or p == ".":
-                    continue
-                cursor = conn.execute(
-                    "SELECT 1 FROM images WHERE path LIKE ? || '/%' LIMIT 1",
-                    (p,)
-                )
-                if cursor.fetchone() is None:
-                    missing.append(p)
-        return missing
-
-    results = query_images_from_db(req_paths)
+        """在 SQL 层判断哪些路径在 images 表中没有任何命中（一条语句完成全部路径的判断）。"""
+        targets = [p for p in paths if p != "" and p != "."]
+        if not targets:
+            return []
+        with get_read_db() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute(MISSING_PATHS_QUERY, {"paths": json.dumps(targets, ensure_ascii=False)})
+            return list(map(itemgetter(0), cursor))
+
+    # 按日期排序直接由 SQLite 完成（mtime 索引）。按名称排序需要自然排序（'a2' 排在 'a10' 之前），
+    # SQLite 的 NOCASE/BINARY 排序规则无法表达，因此和分组类排序一样仍在 Python 中处理
+    order_by = "mtime DESC, path" if req.sort == 'date' else ""
+
+    # limit 作用于最终列表的前 N 张。只有顺序完全由 SQL 决定（随机/日期、正向、无需旋转）时
+    # 才下推为 LIMIT：随机用 ORDER BY RANDOM() 直接抽样，日期沿索引取前 N 条；其余情况最后截断
+    limit = req.limit if req.limit is not None and req.limit > 0 else None
+    sql_limit = None
+    if limit is not None and req.sort in ('shuffle', 'date') and req.direction != 'reverse' and not req.current_path:
+        sql_limit = limit
+        if req.sort == 'shuffle':
+            order_by = "RANDOM()"
+
+    results = query_images_from_db(req_paths, order_by, sql_limit)
     print(f"📚 数据库查询完成，获得 {len(results)} 张图片")
 
     # 仅对“数据库无任何命中”的路径执行扫描（SQL 层判断），避免 Python 层大列表遍历
     # 已同步过的外部路径不再重复扫描
-    missing_paths = get_missing_paths_from_db(req_paths)
+    # req_paths 已标准化并去重，外部路径在送入 SQL 前直接剔除，不再对结果做二次过滤
     if external_paths:
-        external_set = {normalize_rel_path(p) for p in external_paths}
-        missing_paths = [p for p in missing_paths if normalize_rel_path(p) not in external_set]
+        external_set = set(external_paths)
+        missing_paths = get_missing_paths_from_db([p for p in req_paths if p not in external_set])
+    else:
+        missing_paths = get_missing_paths_from_db(req_paths)
 
     if missing_paths:
         print(f"🔍 以下路径在数据库中无记录，开始一次性扫描并回填: {missing_paths}")
         scanned_results = []
         for p in missing_paths:
-            full_path = os.path.abspath(os.path.join(ROOT_DIR, p))
+            full_path = abs_path_from_rel(p)
             images = scan_directory_for_images_heavy(full_path)
             scanned_results.extend(images)
             print(f"📁 扫描目录 {full_path}: 找到 {len(images)} 张图片")
@@ -660,102 +1691,82 @@ async def get_playlist(req: PlaylistRequest, request: Request, background_tasks:
             save_images_to_db(scanned_results)
 
         # 扫描回填后再查一次数据库，确保排序/过滤逻辑一致
-        results = query_images_from_db(req_paths)
+        results = query_images_from_db(req_paths, order_by, sql_limit)
         print(f"📚 回填后数据库查询完成，获得 {len(results)} 张图片")
 
-    # 去重：防止用户选择重叠目录时重复图片进入播放列表
-    dedup_results = {}
-    for item in results:
-        dedup_results[item['path']] = item
-    results = list(dedup_results.values())
-    
+    # 无需再去重：collapse_nested_paths 合并了重叠目录，各区间互不相交，单条 SELECT 返回的 path 天然唯一
+
     # --- 步骤 3: 根据请求进行排序 ---
     if req.sort == 'shuffle':
-        random.shuffle(results)
-        final_paths = [r['path'] for r in results]
+        # 已下推为 ORDER BY RANDOM() LIMIT 时结果本身就是随机顺序，无需再洗牌
+        if sql_limit is None:
+            random.shuffle(results)
+        final_paths = results
     elif req.sort == 'name':
-        results.sort(key=lambda x: natsort_key(x['path']))
-        final_paths = [r['path'] for r in results]
+        results.sort(key=path_sort_key)
+        final_paths = results
     elif req.sort == 'date':
-        results.sort(key=lambda x: x['mtime'], reverse=True)
-        final_paths = [r['path'] for r in results]
-    elif req.sort == 'subfolder_random':
-        subfolder_map = {}
-        for item in results:
-            path = item['path']
-            parent = os.path.dirname(path)
-            if parent not in subfolder_map:
-                subfolder_map[parent] = []
-            subfolder_map[parent].append(item)
-        
-        subfolders = list(subfolder_map.keys())
-        random.shuffle(subfolders)
-        
-        final_paths = []
-        for folder in subfolders:
-            items = subfolder_map[folder]
-            items.sort(key=lambda x: natsort_key(x['path']))
-            final_paths.extend([item['path'] for item in items])
-    elif req.sort == 'subfolder_date':
-        subfolder_map = {}
-        subfolder_mtime = {}
-        
-        for item in results:
-            path = item['path']
-            parent = os.path.dirname(path)
-            if parent not in subfolder_map:
-                subfolder_map[parent] = []
-                try:
-                    folder_full_path = os.path.join(ROOT_DIR, parent) if parent else ROOT_DIR
-                    folder_mtime = os.path.getmtime(folder_full_path)
-                    subfolder_mtime[parent] = folder_mtime
-                except:
-                    subfolder_mtime[parent] = 0
-            subfolder_map[parent].append(item)
-        
-        subfolders = sorted(subfolder_map.keys(), key=lambda x: subfolder_mtime[x])
-        
-        final_paths = []
-        for folder in subfolders:
-            items = subfolder_map[folder]
-            items.sort(key=lambda x: natsort_key(x['path']))
-            final_paths.extend([item['path'] for item in items])
-    elif req.sort == 'subfolder_prefix':
-        subfolder_map = {}
-        for item in results:
-            path = item['path']
-            parent = os.path.dirname(path)
-            if parent not in subfolder_map:
-                subfolder_map[parent] = []
-            subfolder_map[parent].append(item)
-
-        for folder in subfolder_map:
-            subfolder_map[folder].sort(key=lambda x: natsort_key(x['path']))
-
-        subfolders = sorted(
-            subfolder_map.keys(),
-            key=lambda folder: natsort_key(folder_name_prefix_from_first_item(subfolder_map[folder]))
-        )
+        final_paths = results
+    elif req.sort in ('subfolder_random', 'subfolder_date', 'subfolder_prefix'):
+        # 整体自然排序一次后按目录分组，组内顺序即为自然序，每个路径只计算一次排序键
+        results.sort(key=path_sort_key)
+        subfolder_map = group_paths_by_folder(results)
+
+        if req.sort == 'subfolder_random':
+            subfolders = list(subfolder_map.keys())
+            random.shuffle(subfolders)
+        elif req.sort == 'subfolder_date':
+            # ROOT_DIR 内目录的 mtime 在扫描时已记录到 dirs 表，一次查询取回，不再逐个 stat。
+            # 注意这是上次扫描时的目录时间（与播放列表中的图片记录同一时刻），而非实时时间；
+            # ROOT_DIR 外的目录、以及 dirs 表中没有记录的目录（扫描后新建、被跳过的目录）实时 stat
+            in_root_dirs = [parent for parent in subfolder_map if is_rel_path_in_root(parent)]
+            subfolder_mtime = {}
+            if in_root_dirs:
+                with get_read_db() as conn:
+                    cursor = conn.cursor()
+                    cursor.row_factory = None
+                    cursor.execute(
+                        "SELECT dirs.path, dirs.mtime FROM json_each(:dirs) req JOIN dirs ON dirs.path = req.value",
+                        {"dirs": json.dumps(in_root_dirs, ensure_ascii=False)}
+                    )
+                    subfolder_mtime = dict(cursor)
+            for parent in subfolder_map:
+                if parent not in subfolder_mtime:
+                    try:
+                        subfolder_mtime[parent] = os.path.getmtime(abs_path_from_rel(parent))
+                    except OSError:
+                        subfolder_mtime[parent] = 0
+            subfolders = sorted(subfolder_map.keys(), key=subfolder_mtime.__getitem__)
+        else:
+            subfolders = sorted(
+                subfolder_map.keys(),
+                key=lambda folder: natural_key(folder_name_prefix_from_first_item(subfolder_map[folder]))
+            )
 
         final_paths = []
         for folder in subfolders:
-            final_paths.extend([item['path'] for item in subfolder_map[folder]])
+            final_paths.extend(subfolder_map[folder])
     else:
-        results.sort(key=lambda x: natsort_key(x['path']))
-        final_paths = [r['path'] for r in results]
+        results.sort(key=path_sort_key)
+        final_paths = results
         
     if req.direction == 'reverse':
         final_paths.reverse()
 
     # --- 步骤 3: 如果前端提供了当前位置，就旋转列表 ---
     current_path = normalize_rel_path(req.current_path) if req.current_path else None
-    if current_path and (allow_parent_dir_access() or is_path_in_root_dir(current_path)) and current_path in final_paths:
+    if current_path and (allow_parent_dir_access() or is_path_in_root_dir(current_path)):
+        # 直接 index 一次定位，不在列表中时 ValueError；不再先用 in 扫描一遍
         try:
-            print(f"🔄 检测到 current_path='{os.path.basename(current_path)}', 正在旋转列表...")
             start_index = final_paths.index(current_path)
-            final_paths = final_paths[start_index:] + final_paths[:start_index]
         except ValueError:
             pass
+        else:
+            print(f"🔄 检测到 current_path='{os.path.basename(current_path)}', 正在旋转列表...")
+            final_paths = final_paths[start_index:] + final_paths[:start_index]
+
+    if limit is not None:
+        final_paths = final_paths[:limit]
 
     # --- 步骤 4: 更新用户会话并持久化到数据库 ---
     client_ip = request.client.host
@@ -768,15 +1779,17 @@ async def get_playlist(req: PlaylistRequest, request: Request, background_tasks:
     session = UserSession(playlist=final_paths, criteria=criteria)
     user_sessions[client_ip] = session
     
-    # 【核心】持久化播放列表到数据库，确保服务器重启后可恢复
-    save_playlist_to_db(client_ip, final_paths, criteria)
+    # 【核心】持久化播放列表到数据库，确保服务器重启后可恢复。
+    # 在线程池中执行、不阻塞事件循环，但返回前等待写入完成：同一客户端的保存按请求顺序落库，
+    # 不会出现旧列表晚于新列表写入，或在扫描清空播放列表之后才写入的情况
+    await run_in_threadpool(save_playlist_to_db, client_ip, final_paths, criteria)
     
     if final_paths:
         print("🚀 为新列表立即触发一次预加载...")
-        background_tasks.add_task(preload_surrounding_images, final_paths, 0)
+        schedule_session_preload(session, 0, background_tasks)
 
-    print(f"📝 已为IP {client_ip} 创建/更新播放列表，包含 {len(final_paths)} 张图片 (已持久化)")
-    return final_paths
+    print(f"📝 已为IP {client_ip} 创建/更新播放列表，包含 {len(final_paths)} 张图片 (已写入数据库)")
+    return json_response(final_paths)
 
 @app.post("/api/restore-playlist")
 async def restore_playlist(req: RestorePlaylistRequest, request: Request, background_tasks: BackgroundTasks):
@@ -793,8 +1806,8 @@ async def restore_playlist(req: RestorePlaylistRequest, request: Request, backgr
     # 验证 playlist 中的路径是否仍然有效
     valid_paths = []
     for path in playlist:
-        full_path = os.path.join(ROOT_DIR, path)
-        if os.path.exists(full_path) and os.path.isfile(full_path):
+        # isfile 对不存在的路径同样返回 False，一次 stat 即可
+        if os.path.isfile(abs_path_from_rel(normalize_rel_path(path))):
             valid_paths.append(path)
     
     if not valid_paths:
@@ -804,12 +1817,12 @@ async def restore_playlist(req: RestorePlaylistRequest, request: Request, backgr
     session = UserSession(playlist=valid_paths, criteria=req.criteria)
     user_sessions[client_ip] = session
     
-    # 持久化到数据库
-    save_playlist_to_db(client_ip, valid_paths, req.criteria)
+    # 持久化到数据库（线程池中执行，返回前等待写入完成，与 get_playlist 相同）
+    await run_in_threadpool(save_playlist_to_db, client_ip, valid_paths, req.criteria)
     
     # 触发预加载
     current_index = max(0, min(req.current_index, len(valid_paths) - 1))
-    background_tasks.add_task(preload_surrounding_images, valid_paths, current_index)
+    schedule_session_preload(session, current_index, background_tasks)
     
     print(f"🔄 IP {client_ip} 已通过 restore-playlist 恢复播放列表，"
           f"有效: {len(valid_paths)}/{len(playlist)} 张图片")
@@ -861,23 +1874,23 @@ async def get_session_playlist(request: Request):
 
     session = user_sessions.get(client_ip)
     if session:
-        return {
+        return json_response({
             "has_session": True,
             "source": "memory",
             "playlist_size": len(session.playlist),
             "playlist": session.playlist,
             "criteria": session.criteria,
-        }
+        })
 
     playlist, criteria = load_playlist_record_from_db(client_ip)
     if playlist:
-        return {
+        return json_response({
             "has_session": True,
             "source": "database",
             "playlist_size": len(playlist),
             "playlist": playlist,
             "criteria": criteria,
-        }
+        })
 
     return {
         "has_session": False,
@@ -888,44 +1901,47 @@ async def get_session_playlist(request: Request):
     }
 
 @app.get("/api/browse")
-async def browse_folder(path: str = ""):
+def browse_folder(path: str = ""):
+    # 普通 def：目录遍历与排序是阻塞操作，交给 FastAPI 线程池执行，不占用事件循环
     # 支持访问 ROOT_DIR 外的目录（向上浏览 ..），可由开关控制
     if not path or path == ".":
         target_path = ROOT_DIR
         rel_path = ""
     else:
         normalized = normalize_rel_path(path)
-        target_path = os.path.abspath(os.path.join(ROOT_DIR, normalized))
-        if not allow_parent_dir_access() and not is_path_in_root_dir(normalized):
+        target_path = abs_path_from_rel(normalized)
+        if not allow_parent_dir_access() and not is_rel_path_in_root(normalized):
             target_path = ROOT_DIR
             rel_path = ""
         else:
-            rel_path = os.path.relpath(target_path, ROOT_DIR)
+            # normalize_rel_path 已折叠 '.'/'..'，其结果就是相对 ROOT_DIR 的路径
+            rel_path = normalized
     
-    if not os.path.exists(target_path) or not os.path.isdir(target_path):
+    if not os.path.isdir(target_path):
         raise HTTPException(status_code=404, detail="Folder not found")
     
-    items = []
+    # 条目路径直接由当前目录的相对路径拼接，不再逐条计算相对路径
+    item_prefix = rel_path + '/' if rel_path else ""
+
+    # 文件夹与文件只收集名称，直接对字符串排序（无需 lambda 取字段），排好后再一次性生成条目
+    folders = []
+    files = []
     with os.scandir(target_path) as it:
         for entry in it:
-            if entry.name.startswith('.'):
-                continue
-            is_dir = entry.is_dir()
-            if not is_dir and os.path.splitext(entry.name)[1].lower() not in ALLOWED_EXTENSIONS:
+            name = entry.name
+            if name.startswith('.'):
                 continue
-            
-            # 计算返回给前端的路径（用于后续请求）
-            entry_full_path = os.path.abspath(entry.path)
-            entry_rel_from_root = os.path.relpath(entry_full_path, ROOT_DIR)
-            
-            items.append({
-                "name": entry.name,
-                "path": entry_rel_from_root.replace('\\', '/'),
-                "type": "folder" if is_dir else "file"
-            })
-    
-    items.sort(key=lambda x: (x['type'] != 'folder', natsort_key(x['name'])))
-    return {"currentPath": rel_path.replace('\\', '/'), "items": items}
+            if entry.is_dir():
+                folders.append(name)
+            elif is_image_filename(name):
+                files.append(name)
+
+    folders.sort(key=natural_key)
+    files.sort(key=natural_key)
+    # 返回给前端的 path 用于后续请求
+    items = [{"name": name, "path": item_prefix + name, "type": "folder"} for name in folders]
+    items += [{"name": name, "path": item_prefix + name, "type": "file"} for name in files]
+    return json_response({"currentPath": rel_path, "items": items})
 
 def resolve_relative_file_path(path_value: str) -> str:
     """将传入路径标准化为相对于 ROOT_DIR 的可回溯相对路径（可包含 ../）。"""
@@ -940,45 +1956,77 @@ def resolve_full_file_path(path_value: str) -> tuple[str, str]:
     full_path = os.path.abspath(os.path.join(ROOT_DIR, rel_path))
     return rel_path, full_path
 
+# 正在后台恢复会话的客户端：同一客户端的并发请求只触发一次查库
+_recovering_sessions = set()
+
+async def recover_session(client_ip: str, rel_path: str):
+    """
+    后台任务：服务重启后从数据库恢复客户端的播放列表会话，并以当前图片为中心触发预加载。
+    查库在线程池中执行；user_sessions 只在事件循环上读写，查库期间客户端已建立新会话时不覆盖。
+    """
+    try:
+        playlist, criteria = await run_in_threadpool(load_playlist_record_from_db, client_ip)
+        if not playlist or client_ip in user_sessions:
+            return
+        print(f"🔄 [Session Recovery] 从数据库恢复 IP {client_ip} 的播放列表 ({len(playlist)} 张图片)")
+        session = UserSession(playlist=playlist, criteria=criteria)
+        user_sessions[client_ip] = session
+    finally:
+        _recovering_sessions.discard(client_ip)
+
+    current_index = session.index_of(rel_path)
+    if current_index is not None and session.request_preload(current_index):
+        print(f"🚀 [Session Recovery] 触发预加载，当前索引: {current_index}")
+        await run_in_threadpool(run_session_preload, session)
+
+FILE_CACHE_CONTROL = "public, max-age=3600"
+
+def file_validator_headers(stat_result: os.stat_result) -> dict:
+    """内存命中时的缓存头：ETag / Last-Modified 与 FileResponse 由 stat 生成的一致，浏览器可照常做条件请求。"""
+    etag_base = f"{stat_result.st_mtime}-{stat_result.st_size}"
+    return {
+        "Cache-Control": FILE_CACHE_CONTROL,
+        "ETag": f'"{hashlib.md5(etag_base.encode(), usedforsecurity=False).hexdigest()}"',
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+    }
+
 async def serve_file_core(path_value: str, request: Request, background_tasks: BackgroundTasks):
     rel_path, full_path = resolve_full_file_path(path_value)
+    # 与静态挂载一致只提供图片：数据库文件（含各客户端的播放列表）等非图片文件一律按不存在处理
+    if not is_image_filename(full_path):
+        return JSONResponse(status_code=404, content={"message": "File not found"})
     if not allow_parent_dir_access() and not is_path_in_root_dir(rel_path):
         return JSONResponse(status_code=403, content={"message": "Access outside ROOT_DIR is disabled"})
-    if not os.path.exists(full_path) or not os.path.isfile(full_path):
+    try:
+        stat_result = os.stat(full_path)
+    except OSError:
+        stat_result = None
+    if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
         return JSONResponse(status_code=404, content={"message": "File not found"})
 
     client_ip = request.client.host
     session: UserSession = user_sessions.get(client_ip)
 
     if session is None:
-        playlist, criteria = load_playlist_record_from_db(client_ip)
-        if playlist:
-            print(f"🔄 [Session Recovery] 从数据库恢复 IP {client_ip} 的播放列表 ({len(playlist)} 张图片)")
-            session = UserSession(playlist=playlist, criteria=criteria)
-            user_sessions[client_ip] = session
-
-            if rel_path in playlist:
-                try:
-                    current_index = playlist.index(rel_path)
-                    print(f"🚀 [Session Recovery] 触发预加载，当前索引: {current_index}")
-                    background_tasks.add_task(preload_surrounding_images, playlist, current_index)
-                except ValueError:
-                    pass
-
-    if session:
-        session.request_count += 1
-        if session.request_count % 90 == 1:
-            session.request_count = 1
-            try:
-                current_index = session.playlist.index(rel_path)
-                background_tasks.add_task(preload_surrounding_images, session.playlist, current_index)
-            except ValueError:
-                pass
+        # 会话恢复要查库：放到后台任务中执行，本次请求不等待，直接返回文件
+        if client_ip not in _recovering_sessions:
+            _recovering_sessions.add(client_ip)
+            background_tasks.add_task(recover_session, client_ip, rel_path)
+    else:
+        # 按位置而非请求次数触发：离上次预加载中心足够远时才预加载，且每个会话同时只有一个预加载任务
+        current_index = session.index_of(rel_path)
+        if current_index is not None:
+            schedule_session_preload(session, current_index, background_tasks)
 
     try:
-        content = get_image_content(full_path)
-        media_type, _ = mimetypes.guess_type(full_path)
-        return Response(content=content, media_type=media_type or "application/octet-stream")
+        media_type = IMAGE_MIME_TYPES.get('.' + full_path.rpartition('.')[2].lower(), "application/octet-stream")
+        # 预加载命中的图片直接从内存返回；未命中时交给 FileResponse，
+        # 由服务器以 sendfile 从文件描述符直接写入 socket，不再把整张图读进 Python 堆
+        content = image_cache.get(full_path)
+        if content is not None:
+            return Response(content=content, media_type=media_type, headers=file_validator_headers(stat_result))
+        return FileResponse(full_path, media_type=media_type, stat_result=stat_result,
+                            headers={"Cache-Control": FILE_CACHE_CONTROL})
     except Exception as e:
         print(f"❌ 处理文件请求时出错 {rel_path}: {e}")
         raise HTTPException(status_code=500, detail="Error processing file request")
@@ -987,9 +2035,21 @@ async def serve_file_core(path_value: str, request: Request, background_tasks: B
 async def serve_file_by_query(path: str, request: Request, background_tasks: BackgroundTasks):
     return await serve_file_core(path, request, background_tasks)
 
-# @app.get("/{file_path:path}")
-# async def serve_file(file_path: str, request: Request, background_tasks: BackgroundTasks):
-#     return await serve_file_core(file_path, request, background_tasks)
+# 静态直出 ROOT_DIR 内的图片：由 Starlette 的 StaticFiles 直接处理（不经过路由匹配与依赖注入），
+# 适合不需要会话/预加载的直链访问；/api/file 仍负责会话跟踪与父目录访问控制。
+STATIC_CACHE_CONTROL = "public, max-age=3600, immutable"
+
+class ImageStaticFiles(StaticFiles):
+    """只暴露图片文件（隐藏目录与数据库等非图片文件一律 404），并附带长缓存头。"""
+    async def get_response(self, path: str, scope) -> Response:
+        if not is_image_filename(path) or any(part.startswith('.') for part in path.split(os.sep)):
+            raise HTTPException(status_code=404)
+        response = await super().get_response(path, scope)
+        response.headers["Cache-Control"] = STATIC_CACHE_CONTROL
+        return response
+
+# 扫描器会跟随符号链接收录图片，静态挂载也需跟随，否则链接目录中的图片会 404
+app.mount("/static", ImageStaticFiles(directory=ROOT_DIR, check_dir=False, follow_symlink=True), name="static")
 
 
 # # --- 启动方式 ---